@@ -5,10 +5,14 @@ Functions to make and display decision trees, and compute accuracy.
 The titanic dataset takes a long time due to calculating accuracy with loocv.
 Also this requires having Graphviz installed. Also, not sure this works on Windows.
 '''
-import sys, math, heapq, os, math
-from scipy.stats import chi2
+import sys, math, heapq, os, math, hashlib, time, subprocess
+import multiprocessing
+import numpy as np
+from dataTable import *
 from numericTreeClass import *
 from makeHaikuTable import *
+from workerPool import runTasks
+import treeMetrics
 
 def parseFile(fileName):
     '''
@@ -23,6 +27,35 @@ def parseFile(fileName):
     dataFile.close()
     return data
 
+def parseTable(fileName):
+    '''
+    Reads in a tab-delimited dataset like parseFile, with the spaces around the names taken off.
+    The text tables makeHaikuTable.makeTableFile writes have no outcome column and
+    call the attributes TEXT_NAMES; they are given FEATURE_NAMES and every row is
+    unrated, so they read the same as the binary table makeTableFile would write.
+    '''
+    data = parseFile(fileName)
+    header = [name.strip() for name in data[0]]
+    if header == TEXT_NAMES:
+        return [FEATURE_NAMES + ["Outcome"]] + [row + ["unrated"] for row in data[1:]]
+    return [header] + data[1:]
+
+def readTable(fileName):
+    '''
+    Returns the dataset in fileName as a DataTable. Binary tables
+    (see DataTable.save) are memory mapped; anything else is read
+    as tab-delimited text with parseTable.
+    '''
+    if isTableFile(fileName):
+        return loadTable(fileName)
+    return DataTable(parseTable(fileName))
+
+def convertTable(fileName, tableFileName):
+    '''
+    Turns a tab-delimited dataset into a binary table, so it never has to be parsed again.
+    '''
+    DataTable(parseTable(fileName)).save(tableFileName)
+
 def splitData(data):
     '''
     Takes a list of lists, representing a portion of the data.
@@ -33,73 +66,88 @@ def splitData(data):
     {attr1:[[value1, numYes, numNo][value2, numYes, numNo]],
     attr2: [[value2, numYes, numNo][value4, numYes, numNo]],
     etc}
+    The values of each attribute come out sorted from smallest to largest.
+    The counting is done by a DataTable, see dataTable.py.
+    '''
+    return tableToDict(DataTable(data))
+
+def tableToDict(table, rows=None):
+    '''
+    Builds the splitData dictionary from the counts of a DataTable,
+    only counting the given rows (or all of them if rows is None).
     '''
+    numYes, numNo = table.countLevels(rows)
     categoryDict = {}
-    firstLine = data[0]
-    rest = data[1:]
-    for row in rest:
-        for i in range(len(row) - 1):
-            category = firstLine[i]
-            attributeFound = False
-            if category not in categoryDict:
-                categoryDict[category] = []
-            for attribute in categoryDict[category]:
-                if row[i] == attribute[0]:
-                    if row[-1] == 'yes':
-                        attribute[1] += 1
-                    if row[-1] == 'no':
-                        attribute[2] += 1
-                    attributeFound = True
-                    break
-            if not attributeFound:
-                if row[-1] == 'yes':
-                    categoryDict[category].append([row[i], 1, 0])
-                if row[-1] == 'no':
-                    categoryDict[category].append([row[i], 0, 1])
+    for j in range(len(table.names)):
+        start, end = table.offsets[j], table.offsets[j + 1]
+        categoryDict[table.names[j]] = [[str(table.levels[k]), int(numYes[k]), int(numNo[k])]
+                                        for k in range(start, end) if numYes[k] + numNo[k] > 0]
     return categoryDict
 
-def chiSquarePruning(tree):
-    #from bottom up
-    #check if split statistically significant
-    #get rid of if not
+criticalValues = {} #(degrees of freedom, significance) -> chi square critical value
 
+def getCriticalValue(df, significance):
+    '''
+    Returns the chi square value a split with df degrees of freedom has to reach
+    to be significant at the given level. Each one is only computed once.
+    '''
+    key = (df, significance)
+    if key not in criticalValues:
+        #scipy takes longer to import than everything else put together,
+        #so it is only loaded once something actually gets pruned
+        from scipy.stats import chi2
+        criticalValues[key] = chi2.isf(significance, df)
+    return criticalValues[key]
+
+def chiSquarePruning(tree, significance=.05):
+    '''
+    Goes over the tree once from the bottom up (post-order), and for every node
+    whose children are all leaves, checks if the split is statistically significant.
+    If it is not, the children are pruned and the node becomes a leaf with the
+    most common outcome, which may in turn make its parent prunable.
+    '''
     #I use the same notation as the book (pg. 706)
-    leaves = tree.getLeafNodes()
-    leavesPruned = True
-    while leavesPruned:
-        leafParents = []
-        for leaf in leaves:
-            parent = leaf.getParent()
-            if parent not in leafParents:
-                leafParents.append(parent)
-        leavesPruned = False
-        for node in leafParents:
-            numItems = node.getNumItems()
-            df = numItems - 1
+    metrics = treeMetrics.active
+    if metrics is not None:
+        start = time.time()
+    for node, depth in tree.postOrder():
+        children = node.getChildren()
+        if children == []:
+            continue
+        for leaf in children:
+            if leaf.getChildren() != []:
+                break
+        else:
+            if metrics is not None:
+                metrics.count("nodesTested")
+            df = len(children) - 1
             p = node.getNumYes()
             n = node.getNumNo()
             delta = 0
-            for leaf in node.getChildren():
+            for leaf in children:
+                if p + n == 0: #nothing reached this node, so there is nothing to test
+                    break
                 pk = leaf.getNumYes()
                 nk = leaf.getNumNo()
                 pHat = getPHat(p, n, pk, nk)
                 nHat = getNHat(p, n, pk, nk)
-                #if nHat == 0.0:
-                #    nHat = 0.0000000000001
-                #if pHat == 0.0:
-                #    pHat = 0.0000000000001
-                dev = (((pk - pHat)**2)/float(pHat))+(((nk - nHat)**2)/float(nHat))
-                delta += dev
-            prob = chi2.cdf(delta, df)
-            if prob > .05:
+                #an empty child is expected to be empty, so it adds nothing
+                if pHat > 0:
+                    delta += ((pk - pHat)**2)/float(pHat)
+                if nHat > 0:
+                    delta += ((nk - nHat)**2)/float(nHat)
+            if delta < getCriticalValue(df, significance):
                 #we want to prune
-                leavesPruned = True
+                node.setName("Outcome")
                 if p > n:
                     node.setOutcome("YES")
                 else:
                     node.setOutcome("NO")
                 node.pruneChildren()
-        leaves = tree.getLeafNodes()
+                if metrics is not None:
+                    metrics.count("nodesPruned")
+    if metrics is not None:
+        metrics.addTime("chiSquarePruning", time.time() - start)
 
 def getPHat(p, n, pk, nk):
     pHat = p * ((pk+nk)/float(p+n))
@@ -119,36 +167,72 @@ def entropy(q):
         e = -1 * (q * math.log(q, 2) + (1-q) * math.log((1 - q), 2))
         return e
 
+def entropyArray(q):
+    '''
+    Same as entropy(q), but for a whole NumPy array of probabilities at once.
+    '''
+    q = np.asarray(q, dtype=float)
+    e = np.zeros(q.shape)
+    mixed = (q > 0) & (q < 1)
+    qMixed = q[mixed]
+    e[mixed] = -1 * (qMixed * np.log2(qMixed) + (1 - qMixed) * np.log2(1 - qMixed))
+    return e
+
+def attributeGains(numYes, numNo, offsets):
+    '''
+    Calculates the information gain of every attribute in one go.
+    numYes and numNo hold the counts for each value of each attribute,
+    laid out one attribute after another, where attribute j owns the
+    slots offsets[j] up to offsets[j+1] (this is the DataTable layout).
+
+    Returns an array with the gain of each attribute.
+    '''
+    numYes = np.asarray(numYes, dtype=float)
+    numNo = np.asarray(numNo, dtype=float)
+    offsets = np.asarray(offsets)
+    numAttrs = len(offsets) - 1
+    numValues = numYes + numNo
+    if numAttrs == 0 or len(numValues) == 0:
+        return np.zeros(numAttrs)
+    totalYes = numYes[offsets[0]:offsets[1]].sum()
+    totalNo = numNo[offsets[0]:offsets[1]].sum()
+    total = totalYes + totalNo
+    if total == 0:
+        return np.zeros(numAttrs)
+
+    probYes = np.divide(numYes, numValues, out=np.zeros(len(numValues)), where=numValues > 0)
+    weighted = entropyArray(probYes) * numValues / total
+    #sum up the weighted entropies of the values belonging to each attribute
+    sums = np.concatenate(([0.0], np.cumsum(weighted)))
+    remainder = sums[offsets[1:]] - sums[offsets[:-1]]
+    return entropy(totalYes / total) - remainder
+
+def makeEntropyHeap(names, gains):
+    '''
+    Puts the attributes in a heap ordered by information gain
+    (popping gives you the item with highest gain).
+    '''
+    entropyHeap = [[float(1 - gain), name] for gain, name in zip(gains, names)] #we do 1-gain because heapq makes a min heap
+    heapq.heapify(entropyHeap)
+    return entropyHeap
+
 def calculateEntropy(categoryDict):
     '''
     Takes a dictionary of the form produced by splitData.
     Creates a heap orderded by information gain 
     (popping gives you the item with highest gain).
-    Calls the entropy(q) function.
+    All the attributes are scored at once by attributeGains.
     '''
-    entropyHeap = []
-    #print categoryDict
-    totalYes = 0
-    totalNo = 0
-    someCategory = categoryDict.keys()[0]
-    for attribute in categoryDict[someCategory]:
-        totalYes += attribute[1]
-        totalNo += attribute[2] 
-
-    for category in categoryDict:
-        remainder = 0
-        curCategory = categoryDict[category]
-        for attribute in curCategory:
-            numYes = attribute[1]
-            numNo = attribute[2]
-            probYes = numYes/float(numYes + numNo)
-            probNo = numNo/float(numYes + numNo)
-            e = entropy(probYes)
-            remainder += e * (numYes + numNo)/float(totalYes + totalNo)
-
-        gain = entropy(totalYes/float(totalYes+totalNo)) - remainder
-        heapq.heappush(entropyHeap, [1 - gain, category]) #we do 1-gain because heapq makes a min heap
-    return entropyHeap
+    names = list(categoryDict.keys())
+    offsets = [0]
+    counts = []
+    for category in names:
+        for attribute in categoryDict[category]:
+            counts.append(attribute[1:3])
+        offsets.append(len(counts))
+    counts = np.array(counts, dtype=float).reshape(-1, 2)
+    gains = attributeGains(counts[:, 0], counts[:, 1], offsets)
+    return makeEntropyHeap(names, gains)
 
 
 def calculateConfidence(categoryDict):
@@ -203,68 +287,116 @@ def calculateConfidence(categoryDict):
 
 
 
-def makeTree(fullData):
+def makeTree(fullData, rows=None, attributes=None, maxDepth=None, minLeaf=None, maxBins=None):
     '''
     Given a training set (fullData) this makes a DecisionTree object.
     Follows the ID3 algorithm.
+    fullData can be the list of lists from parseFile or a DataTable.
+    If rows (an array of row indices, repeats allowed) is given, only those rows are used.
+    If attributes (indices into the table's names) is given, only those can be split on.
+    maxDepth and minLeaf stop the tree growing early, see limitDecision;
+    by default it grows until it runs out of data or attributes.
+    If maxBins is given, every attribute is first cut into at most that many bins
+    (see DataTable.binned) and splits are only looked for between bins. The
+    thresholds are still values of the attribute, so the tree classifies
+    unbinned items as usual; more bins give splits closer to the exact ones.
     Calls the recursive makeTreeHelper.
     '''
-    dataDict = splitData(fullData)
-    #print "DATA:  ", dataDict
-    entropyHeap = calculateEntropy(dataDict)
-    tree = DecisionTree()
-    splitVal = heapq.heappop(entropyHeap) #contains the attribute to split on
-    #splitval should be the same, I think this is the right category (like numNouns, etc.)
-    rootNode = Node()
-    rootNode.setName(splitVal[1])
-    tree.setRoot(rootNode)
-    numYes = 0
-    numNo = 0
-    for j in dataDict[splitVal[1]]: 
-        numYes += j[1]              
-        numNo += j[2]
+    with treeMetrics.timed("makeTree"):
+        if isinstance(fullData, DataTable):
+            table = fullData
+        else:
+            table = DataTable(fullData)
+        if maxBins is not None:
+            table = table.binned(maxBins)
+        if rows is None:
+            rows = table.allRows()
+        if attributes is None:
+            attributes = range(len(table.names))
+        attributes = frozenset(attributes)
+        metrics = treeMetrics.active
+        if metrics is not None:
+            metrics.count("treesBuilt")
+            metrics.count("nodesBuilt")
+            metrics.count("rowsScanned", len(rows))
+        levelCounts = table.countLevels(rows)
+        numYes, numNo = levelCounts
+        entropyHeap = tableEntropy(table, numYes, numNo, attributes)
+        tree = DecisionTree()
+        splitVal = heapq.heappop(entropyHeap) #contains the attribute to split on
+        #splitval should be the same, I think this is the right category (like numNouns, etc.)
+        rootNode = Node()
+        rootNode.setName(splitVal[1])
+        tree.setRoot(rootNode)
+        #every rated row has exactly one value for the first attribute
+        numYes = int(numYes[table.offsets[0]:table.offsets[1]].sum())
+        numNo = int(numNo[table.offsets[0]:table.offsets[1]].sum())
 
-    if numYes == 0:
-        rootNode.setOutcome("NO")
-        return tree
-    if numNo == 0:
-        rootNode.setOutcome("YES")
+        if numYes == 0:
+            rootNode.setOutcome("NO")
+            return tree
+        if numNo == 0:
+            rootNode.setOutcome("YES")
+            return tree
+        rootNode.setNumItems(numNo+numYes)
+        rootNode.setNumYes(numYes)
+        rootNode.setNumNo(numNo)
+        makeTreeHelper(tree.getRoot(), table, rows, attributes, 0, maxDepth, minLeaf, levelCounts)
+        tree.contract() #this is a super hacky way of getting rid of any nodes which split into two of the same outcomes
         return tree
-    rootNode.setNumItems(numNo+numYes)
-    rootNode.setNumYes(numYes)
-    rootNode.setNumNo(numNo)
-    makeTreeHelper(tree.getRoot(), fullData, dataDict[rootNode.getName()])
-    tree.contract() #this is a super hacky way of getting rid of any nodes which split into two of the same outcomes
-    return tree
-
-def findBestSplitNum(numericData):
-    '''
-    This finds the best index to split the numeric data in a node on in order to maximize info gain.
-    UNTESTED.
-    '''
-    numericData.sort() #isn't working?
-    possibleSplits = []
-    for i in numericData:
-        num = int(i[0])
-        if num not in possibleSplits:
-            possibleSplits.append(num)
-    possibleSplits.sort()
-    possibleSplits = possibleSplits[:-1]
-    bestSplit = 0
-    maxInfoGain = 0
-    for num in possibleSplits:
-        lowData = []
-        highData = []
-        for i in range(len(numericData)):
-            if int(numericData[i][0]) <= num:
-                lowData.append(numericData[i])
-            else:
-                highData.append(numericData[i])
-        info = getInfoGain(lowData, highData)
-        if info > maxInfoGain:
-            maxInfoGain = info
-            bestSplit = num
-    return bestSplit
+
+def tableEntropy(table, numYes, numNo, attributes):
+    '''
+    Like calculateEntropy, but straight from the level counts of a DataTable
+    (see DataTable.countLevels). Only the attributes whose indices are in
+    attributes go in the heap.
+    '''
+    gains = attributeGains(numYes, numNo, table.offsets)
+    attributes = sorted(attributes)
+    return makeEntropyHeap([table.names[j] for j in attributes], [gains[j] for j in attributes])
+
+def findBestSplitNum(values, numYes, numNo):
+    '''
+    This finds the best value to split the numeric data in a node on in order to maximize info gain.
+    values are the distinct values of the attribute sorted from smallest to largest
+    (the order DataTable keeps its levels in), and numYes/numNo the counts for each value.
+
+    Instead of rebuilding the low and high halves for every threshold, the counts on the
+    low side of every threshold come from running totals, so all thresholds are scored at once.
+    Returns (bestSplit, maxInfoGain); items <= bestSplit go low, the rest go high.
+    If no threshold gains anything, bestSplit is 0.
+    '''
+    values = np.asarray(values)
+    numYes = np.asarray(numYes, dtype=float)
+    numNo = np.asarray(numNo, dtype=float)
+    present = (numYes + numNo) > 0 #only values that actually show up in this node can be thresholds
+    values = values[present]
+    numYes = numYes[present]
+    numNo = numNo[present]
+    if len(values) < 2:
+        return 0, 0.0
+    if treeMetrics.active is not None:
+        treeMetrics.active.count("thresholdsEvaluated", len(values) - 1)
+
+    #splitting on the largest value puts everything low, so it is left out
+    lowYes = np.cumsum(numYes)[:-1]
+    lowNo = np.cumsum(numNo)[:-1]
+    parentYes = numYes.sum()
+    parentNo = numNo.sum()
+    highYes = parentYes - lowYes
+    highNo = parentNo - lowNo
+    total = parentYes + parentNo
+    lowTotal = lowYes + lowNo
+    highTotal = highYes + highNo
+    remainder = entropyArray(lowYes / lowTotal) * lowTotal / total
+    remainder += entropyArray(highYes / highTotal) * highTotal / total
+    gains = entropy(parentYes / total) - remainder
+    gains = np.round(gains, 12) #so that equally good splits really tie instead of differing by rounding error
+
+    best = int(np.argmax(gains)) #first maximum, so ties go to the smallest threshold
+    if gains[best] <= 0:
+        return 0, 0.0
+    return int(values[best]), float(gains[best])
 
 def getInfoGain(low, high):
     '''
@@ -298,234 +430,508 @@ def getInfoGain(low, high):
 
 
 
-def makeTreeHelper(rootNode, examples, parentExamples):
+def nodeDecision(table, numYes, numNo, attributes):
+    '''
+    Decides what a node does, given the level counts of the rows that reach it
+    (see DataTable.countLevels) and the set of attributes left to split on.
+
+    Returns [category, outcome, splitNum]:
+    category is the index of the attribute picked by info gain (None if the node is pure),
+    outcome is "YES" or "NO" if the node is a leaf, otherwise None,
+    and splitNum is the threshold to split category on (None for leaves).
+    '''
+    entropyHeap = tableEntropy(table, numYes, numNo, attributes)
+    splitVal = heapq.heappop(entropyHeap) #attribute to split on
+    category = table.names.index(splitVal[1])
+    start = table.offsets[category]
+    end = table.offsets[category + 1]
+    totalYes = int(numYes[start:end].sum())
+    totalNo = int(numNo[start:end].sum())
+
+    if totalYes == 0:
+        return [None, "NO", None]
+    elif totalNo == 0:
+        return [None, "YES", None]
+    elif entropyHeap == []: #this is the last attribute
+        if totalYes > totalNo:
+            return [category, "YES", None]
+        else:
+            return [category, "NO", None]
+    else:
+        splitNum, splitGain = findBestSplitNum(table.getLevels(category), numYes[start:end], numNo[start:end])
+        return [category, None, splitNum]
+
+def getSplitCut(table, category, splitNum):
+    '''
+    Returns the level index where the high side of a split starts:
+    levels of category below it are the values <= splitNum.
+    '''
+    return table.offsets[category] + int(np.searchsorted(table.getLevels(category), splitNum, side="right"))
+
+def limitDecision(table, numYes, numNo, decision, depth, maxDepth, minLeaf):
+    '''
+    Turns the split nodeDecision picked into a leaf with the most common outcome
+    if the node is already maxDepth splits deep (the root is depth 0),
+    or if either side of the split would get fewer than minLeaf rated rows.
+    Either limit can be None. Only makeTree uses this: the count trees of
+    looCV and OnlineTree are always grown in full.
+    '''
+    category, outcome, splitNum = decision
+    if outcome:
+        return decision
+    start = table.offsets[category]
+    end = table.offsets[category + 1]
+    cut = getSplitCut(table, category, splitNum)
+    numLow = int(numYes[start:cut].sum() + numNo[start:cut].sum())
+    numHigh = int(numYes[cut:end].sum() + numNo[cut:end].sum())
+    if (maxDepth is not None and depth >= maxDepth) or (minLeaf is not None and min(numLow, numHigh) < minLeaf):
+        if numYes[start:end].sum() > numNo[start:end].sum():
+            return [category, "YES", None]
+        else:
+            return [category, "NO", None]
+    return decision
+
+def childOutcome(numYes, numNo):
+    '''
+    The outcome of a child node straight from its counts,
+    or None if it has both kinds of rows and needs splitting further.
+    '''
+    if numYes == 0:
+        return "NO"
+    elif numNo == 0:
+        return "YES"
+    return None
+
+def makeTreeHelper(rootNode, table, rows, attributes, depth=0, maxDepth=None, minLeaf=None, counts=None):
     '''
     Recursive helper function for makeTree.
     Closely follows the algorithm as laid out in the textbook.
 
-    changed for numeric data. UNTESTED.
+    All the nodes share one DataTable. rows is the array of indices of the rows
+    that reach this node, and attributes is the set of attribute indices
+    we have not split on yet, so nothing gets copied on the way down.
+    depth is how many splits are above rootNode.
+    counts is (numYes, numNo) from table.countLevels(rows) if the caller already has them.
+    Only the smaller child's rows get counted again: the other child's counts
+    are what is left of this node's.
     '''
-    
-    if len(examples) == 1: #we are out of examples
-        parentNumYes = 0
-        parentNumNo = 0
-        childNode = Node()
-        childNode.setParent(rootNode)
-        rootNode.addChild(childNode)
-        childNode.setValue(rootNode.getValue())
-        for row in parentExamples:
-            parentNumYes += row[1]
-            parentNumNo += row[2]
-        if parentNumYes > parentNumNo: #pick most common
-            childNode.setOutcome("YES")
-        else:
-            childNode.setOutcome("NO")
-    
+    metrics = treeMetrics.active
+    if metrics is not None:
+        searchStart = time.time()
+    if counts is None:
+        if metrics is not None:
+            metrics.count("rowsScanned", len(rows))
+        counts = table.countLevels(rows)
+    numYes, numNo = counts
+    decision = nodeDecision(table, numYes, numNo, attributes)
+    if maxDepth is not None or minLeaf is not None:
+        decision = limitDecision(table, numYes, numNo, decision, depth, maxDepth, minLeaf)
+    category, outcome, splitNum = decision
+    if metrics is not None:
+        metrics.addTime("splitSearch", time.time() - searchStart)
+
+    if category is None:
+        rootNode.setName("Outcome")
+        rootNode.setOutcome(outcome)
+    elif outcome:
+        rootNode.setName(table.names[category])
+        rootNode.setOutcome(outcome)
     else:
-        dataDict = splitData(examples)
-        entropyHeap = calculateEntropy(dataDict)
-        splitVal = heapq.heappop(entropyHeap) #attribute to split on
-        rootNode.setName(splitVal[1])
-        numericData = dataDict[splitVal[1]]
-        #value[0] is the number
-        totalYes = 0
-        totalNo = 0
-
-        for i in numericData:
-            totalYes +=i[1]
-            totalNo +=i[2]
-        if totalYes == 0:
-            rootNode.setName("Outcome")
-            rootNode.setOutcome("YES")
-        elif totalNo == 0:
-            rootNode.setName("Outcome")
-            rootNode.setOutcome("NO")
-        elif len(dataDict) == 1:
-            if totalYes > totalNo:
-                rootNode.setOutcome("YES")
+        rootNode.setName(table.names[category])
+        if metrics is not None:
+            partitionStart = time.time()
+        start = table.offsets[category]
+        end = table.offsets[category + 1]
+        cut = getSplitCut(table, category, splitNum)
+        goesLow = table.codes[category, rows] < cut
+        remaining = attributes - frozenset([category]) #we remove the attribute we split on
+        #only pass on the indices of the rows corresponding to the split
+        childRows = [rows[goesLow], rows[~goesLow]]
+        childCounts = [(int(numYes[start:cut].sum()), int(numNo[start:cut].sum())),
+                       (int(numYes[cut:end].sum()), int(numNo[cut:end].sum()))]
+        childLevelCounts = [None, None]
+        if childOutcome(*childCounts[0]) is None or childOutcome(*childCounts[1]) is None:
+            small = int(len(childRows[1]) < len(childRows[0]))
+            if metrics is not None:
+                metrics.count("rowsScanned", len(childRows[small]))
+            smallYes, smallNo = table.countLevels(childRows[small])
+            childLevelCounts[small] = (smallYes, smallNo)
+            childLevelCounts[1 - small] = (numYes - smallYes, numNo - smallNo)
+
+        if metrics is not None:
+            metrics.addTime("partition", time.time() - partitionStart)
+            metrics.count("nodesBuilt", 2)
+            metrics.noteDepth(depth + 1)
+        for side in (0, 1): #This just look through both splits and makes then child nodes.
+            childNode = Node()
+            childNode.setParent(rootNode)
+            rootNode.addChild(childNode)
+            if side == 0:
+                childNode.setValue("<= " + str(splitNum))
+            else:
+                childNode.setValue("> " + str(splitNum))
+            numYesChild, numNoChild = childCounts[side]
+            childNode.setName("Outcome") #will be reset by children if not a leaf node
+
+            childNode.setNumItems(numYesChild+numNoChild)
+            childNode.setNumYes(numYesChild)
+            childNode.setNumNo(numNoChild)
+            outcome = childOutcome(numYesChild, numNoChild)
+            if outcome:
+                childNode.setOutcome(outcome)
             else:
-                rootNode.setOutcome("NO")
+                makeTreeHelper(childNode, table, childRows[side], remaining, depth + 1, maxDepth, minLeaf,
+                               childLevelCounts[side])
+    return
+
+def makeCountTree(table, rows, attributes):
+    '''
+    Makes the same splits as makeTreeHelper, but instead of Nodes it keeps
+    what each node needs to redo its decision later: the rows that reach it,
+    their level counts, the decision itself and the child count nodes
+    (None for children that are leaves).
+    '''
+    numYes, numNo = table.countLevels(rows)
+    countNode = {"rows": rows, "numYes": numYes, "numNo": numNo,
+                 "decision": nodeDecision(table, numYes, numNo, attributes), "children": [None, None]}
+    category, outcome, splitNum = countNode["decision"]
+    if not outcome:
+        cut = getSplitCut(table, category, splitNum)
+        goesLow = table.codes[category, rows] < cut
+        remaining = attributes - frozenset([category])
+        for childIndex, childRows in enumerate([rows[goesLow], rows[~goesLow]]):
+            labels = table.labels[childRows]
+            if childOutcome(np.sum(labels == 1), np.sum(labels == 0)) is None:
+                countNode["children"][childIndex] = makeCountTree(table, childRows, remaining)
+    return countNode
+
+def predictLeftOut(table, rows, numYes, numNo, attributes, row):
+    '''
+    Follows the path of row through the tree makeTree would grow from rows
+    (which must not contain row), without making the rest of the tree.
+    numYes and numNo are the level counts of rows.
+    Returns the outcome row ends up with.
+    '''
+    category, outcome, splitNum = nodeDecision(table, numYes, numNo, attributes)
+    while not outcome:
+        cut = getSplitCut(table, category, splitNum)
+        low = table.codes[category, row] < cut
+        if low:
+            rows = rows[table.codes[category, rows] < cut]
         else:
-            splitNum = findBestSplitNum(numericData)
-            lowData = numericData[:splitNum + 1]
-            highData = numericData[splitNum + 1:]
-            numericData = [lowData, highData]
-            #ok, here we need to take data in splitVal category and split into two groups to maximize info gain
-
-            for value in numericData: #This just look through both splits and makes then child nodes.
-                low = False
-                high = False
-                if value == lowData:
-                    low = True
-                else:
-                    high = True 
-                childNode = Node()
-                childNode.setParent(rootNode)
-                rootNode.addChild(childNode)
-                if low:
-                    childNode.setValue("<= " + str(splitNum))
-                else:
-                    childNode.setValue("> " + str(splitNum))
-                childNode.setName("Outcome") #will be reset by children if not a leaf node
-
-                numYes = 0
-                numNo = 0
-                for i in value:
-                    numYes += i[1]
-                    numNo += i[2]
-
-                childNode.setNumItems(numYes+numNo)
-                childNode.setNumYes(numYes)
-                childNode.setNumNo(numNo)
-                if numYes == 0:
-                    #print "this node all no", splitNum
-                    childNode.setOutcome("NO")
-                elif numNo == 0:
-                    #print "this node all yes", splitNum
-                    childNode.setOutcome("YES")
-
-                elif entropyHeap == []: #we are out of attributes to split on
-                    #print "no more attributes", splitNum
-                    if numYes > numNo: #pick most common outcome
-                        childNode.setOutcome("YES")
-                    else:
-                        childNode.setOutcome("NO")
+            rows = rows[table.codes[category, rows] >= cut]
+        labels = table.labels[rows]
+        outcome = childOutcome(np.sum(labels == 1), np.sum(labels == 0))
+        if outcome:
+            break
+        attributes = attributes - frozenset([category])
+        numYes, numNo = table.countLevels(rows)
+        category, outcome, splitNum = nodeDecision(table, numYes, numNo, attributes)
+    return outcome
 
-                else:
-                    #now we remove the attribute we split on from the data, and only pass on the data corresponding to the split
-                    categoryIndex = examples[0].index(splitVal[1])
-                    newExamples = [examples[0][:categoryIndex]+examples[0][(categoryIndex+1)%len(examples[0]):]]
-                    for e in examples[1:]:
-                        if low and int(e[categoryIndex]) <= splitNum:
-                            newE = e[:categoryIndex]+e[categoryIndex+1 % len(e):]
-                            newExamples.append(newE)
-                        if high and int(e[categoryIndex]) > splitNum:
-                            newE = e[:categoryIndex]+e[categoryIndex+1 % len(e):]
-                            newExamples.append(newE)
-                    parentExamples = dataDict[splitVal[1]]
-                    makeTreeHelper(childNode, newExamples, parentExamples)
-    return
-                
-def looCV(dataSet):
+def predictLeftOutIncremental(table, countNode, attributes, row):
+    '''
+    Gives the same answer as predictLeftOut on all the rows of countNode but row,
+    using the counts stored by makeCountTree. At every node on the path of row,
+    its counts are taken out and the decision is redone from the counts alone;
+    only if the decision changes is the rest of the path regrown from the rows.
+    '''
+    levels = table.codes[:, row]
+    while True:
+        numYes = countNode["numYes"]
+        numNo = countNode["numNo"]
+        if table.labels[row] == 1:
+            numYes = numYes.copy()
+            numYes[levels] -= 1
+        else:
+            numNo = numNo.copy()
+            numNo[levels] -= 1
+        decision = nodeDecision(table, numYes, numNo, attributes)
+        if decision != countNode["decision"]:
+            if treeMetrics.active is not None:
+                treeMetrics.active.count("subtreesRegrown")
+            rows = countNode["rows"]
+            return predictLeftOut(table, rows[rows != row], numYes, numNo, attributes, row)
+        category, outcome, splitNum = decision
+        if outcome:
+            return outcome
+        cut = getSplitCut(table, category, splitNum)
+        start = table.offsets[category]
+        end = table.offsets[category + 1]
+        if levels[category] < cut:
+            childIndex = 0
+            outcome = childOutcome(numYes[start:cut].sum(), numNo[start:cut].sum())
+        else:
+            childIndex = 1
+            outcome = childOutcome(numYes[cut:end].sum(), numNo[cut:end].sum())
+        if outcome:
+            return outcome
+        #a child that was a leaf stays one without row, so there is a count node here
+        countNode = countNode["children"][childIndex]
+        attributes = attributes - frozenset([category])
+
+def looCV(dataSet, incremental=True):
     '''
     Leave one out cross validation.
-    Takes a data set, returns the accuracy of the 
-    decisionTree, made using ID3.
+    Takes a data set (parsed list of lists or DataTable), returns the accuracy of the 
+    decisionTree, made using ID3. Only rows rated yes or no are left out and tested.
+
+    If incremental is True, the counts of the tree on all the data are made once,
+    and for every left out row only the nodes on its path are redone without it,
+    regrowing a subtree only where its split changes.
+    Otherwise a whole new tree is made for every row, which takes a long time
+    on big data sets. Both ways give the same accuracy.
     '''
-    numCorrect = 0
-    numItems = len(dataSet) - 1
-    for i in range(1,len(dataSet)):
-        testItem = dataSet.pop(i) #the data point we will try to classify
-        testTree = makeTree(dataSet)
+    with treeMetrics.timed("looCV"):
+        if isinstance(dataSet, DataTable):
+            table = dataSet
+        else:
+            table = DataTable(dataSet)
+        allRows = table.allRows()
+        attributes = frozenset(range(len(table.names)))
+        if incremental:
+            countTree = makeCountTree(table, allRows, attributes)
+            #leaving out either of two identical rows gives the same tree, so each kind of row is only done once
+            seenRows = {}
+
+        numCorrect = 0
+        numItems = 0
+        metrics = treeMetrics.active
+        for testRow in allRows[table.labels >= 0]:
+            numItems += 1
+            if metrics is not None:
+                metrics.count("rowsLeftOut")
+            if incremental:
+                rowKey = (table.labels[testRow],) + tuple(table.codes[:, testRow])
+                if rowKey not in seenRows:
+                    seenRows[rowKey] = predictLeftOutIncremental(table, countTree, attributes, testRow)
+                outcome = seenRows[rowKey]
+            else:
+                testTree = makeTree(table, allRows[allRows != testRow])
+                outcome = testTree.search(table.getItem(testRow))
+
+            if not outcome: #there was no branch in the decision tree for the specified data point
+                numItems -= 1
+            elif outcome == table.getOutcome(testRow):
+                numCorrect += 1
+        accuracy = numCorrect/float(numItems)
+        return accuracy
 
-        #make a dictionary in order to pair the categories and values for the data point
-        itemDict = {}
-        categories = dataSet[0]
-        for i in range(len(categories) - 1):
-            itemDict[categories[i]] = testItem[i]
+def assignFolds(table, numFolds=None, seed=0):
+    '''
+    Splits the rated rows of a DataTable into folds for cross validation.
+    The rows are shuffled with the given seed, so the same seed always gives
+    the same folds. If numFolds is None, every rated row is its own fold (leave one out).
+    Returns a list of arrays of row indices.
+    '''
+    ratedRows = table.allRows()[table.labels >= 0]
+    if numFolds is None or numFolds >= len(ratedRows):
+        return [ratedRows[i:i + 1] for i in range(len(ratedRows))]
+    shuffled = np.random.RandomState(seed).permutation(ratedRows)
+    return [np.sort(shuffled[k::numFolds]) for k in range(numFolds)]
 
-        outcome = testTree.search(itemDict)
-        if not outcome: #there was no branch in the decision tree for the specified data point
-            numItems -= 1
+cvTable = None #the DataTable a cross validation worker process trains on
 
-        elif outcome.lower() == testItem[-1]:
-            numCorrect += 1
-        dataSet.insert(i, testItem)
-    accuracy = numCorrect/float(numItems)
-    return accuracy
+def initCVWorker(table):
+    global cvTable
+    cvTable = table
 
+def testFold(args):
+    '''
+    Trains a tree on every row but the ones in testRows (no deeper than maxDepth
+    and with at least minLeaf rows on each side of a split, see makeTree),
+    prunes it if asked (at the given significance level),
+    and classifies the test rows with it.
+    Runs in a worker process, on the table given to initCVWorker.
+    Returns (numCorrect, numItems).
+    '''
+    testRows, prune, significance, maxDepth, minLeaf = args
+    allRows = cvTable.allRows()
+    trainRows = allRows[~np.in1d(allRows, testRows)]
+    tree = makeTree(cvTable, trainRows, None, maxDepth, minLeaf)
+    if prune:
+        chiSquarePruning(tree, significance)
+    return scoreTree(cvTable, tree, testRows)
+
+def scoreTree(table, tree, testRows):
+    '''
+    Classifies the test rows with the tree, all at once.
+    Returns (numCorrect, numItems); rows with no branch in the tree are not counted.
+    '''
+    outcomes = tree.compile(table.names).predictBatch(table.getFeatures(testRows))
+    found = outcomes >= 0
+    numCorrect = int(np.sum(outcomes[found] == table.labels[testRows][found]))
+    return numCorrect, int(np.sum(found))
 
-def activeLearning(treeTimes, parsedFile):
+def crossValidate(dataSet, numFolds=None, seed=0, prune=True, significance=.05, numProcesses=None,
+                  maxDepth=None, minLeaf=None):
+    '''
+    k-fold cross validation (leave one out if numFolds is None) with the folds
+    spread over a pool of worker processes. Each fold makes a tree with makeTree
+    (using maxDepth and minLeaf),
+    prunes it with chiSquarePruning at the given significance level
+    (unless prune is False) and tests it with scoreTree, which classifies
+    all the fold's rows at once with CompiledTree.predictBatch.
+
+    Folds are assigned by assignFolds, so a seed always gives the same accuracy
+    no matter how many processes there are. The table is put in shared memory
+    and handed to each worker once when it starts; the tasks only carry row indices.
+    numProcesses is passed on to workerPool.runTasks.
+    Returns the accuracy.
+    '''
+    with treeMetrics.timed("crossValidate"):
+        if isinstance(dataSet, DataTable):
+            table = dataSet
+        else:
+            table = DataTable(dataSet)
+        tasks = [(fold, prune, significance, maxDepth, minLeaf) for fold in assignFolds(table, numFolds, seed)]
+        #leave one out makes lots of tiny tasks, so hand them out in batches
+        chunkSize = max(1, len(tasks) // (4 * (numProcesses or multiprocessing.cpu_count())))
+        results = list(runTasks(testFold, tasks, initCVWorker, (table,), numProcesses, chunkSize))
+
+        numCorrect = sum(result[0] for result in results)
+        numItems = sum(result[1] for result in results)
+        if treeMetrics.active is not None:
+            treeMetrics.active.count("foldsTested", len(tasks))
+            treeMetrics.active.count("rowsTested", numItems)
+        accuracy = numCorrect/float(numItems)
+        return accuracy
+
+
+def activeLearning(treeTimes, parsedFile, onlineTree=None):
     """
     the active learning algorithm uses confidence intervals to determine which poem the user should rate
     that would be most useful in building a better decision tree
+    if onlineTree (an OnlineTree made from parsedFile) is given, the new rating is added to it,
+    so its tree is up to date without being regrown
     """
     heap = treeTimes.createConfidenceHeap(parsedFile)
     bestGuess = heapq.heappop(heap)[1]
 
-    #we need to get an unrated haiku from our haikudb here
-    unratedPoems = []
-    lineNum = 0
-    unratedLineNumList = []
-    for poem in parsedFile:
-        lineNum += 1
-        if poem[-1] == None or poem[-1] == "None":
-            unratedPoems.append(poem)
-            unratedLineNumList.append(lineNum)
-
-    unratedIndex = 0
-    haikuDB = open("haikuDB")
-    haikuList = []
-    for line in haikuDB:
-        line = line.split("\t")
-        try:
-            val = int(line[0])
-            haiku = ""
-            if val in unratedLineNumList:
-                next1 = haikuDB.next()
-                next2 = haikuDB.next()
-                haiku += line[1] + next1 + next2
-                haikuList.append(haiku)
-        except ValueError:
-            pass
-
-    index = 0
-    for individualHaiku in unratedPoems:
-        index += 1
-        entryDict = {}
-        for i in range(len(parsedFile[0])):
-            entryDict[parsedFile[0][i]] = individualHaiku[i]
-        if treeTimes.isItemInNode(entryDict, bestGuess):
-            rating = ""
-            while rating != "yes" or rating != "no":
-                print 
-                print haikuList[index]
-                rating = raw_input("Please rate this haiku.  Is it good?  Enter y/n: ")
-                #then we need to add this to our rating
-                if rating == "y":
-                    individualHaiku[-1] = "yes"
-                    break
-                if rating == "n":
-                    individualHaiku[-1] = "no"
-                    break
-            parsedFile.append(individualHaiku)
+    #we need to get an unrated haiku from our haikudb here.
+    #every unrated row is checked against the node's bounds at once
+    table = DataTable(parsedFile)
+    compiledTree = treeTimes.compile(table.names)
+    unratedRows = table.allRows()[table.labels < 0]
+    inNode = compiledTree.itemsInNode(table.getFeatures(unratedRows), compiledTree.getIndex(bestGuess))
+    if len(inNode) == 0:
+        return
+    #row i of the table is line i+1 of parsedFile, and haiku number i in haikuDB
+    dataLines = [i for i in range(1, len(parsedFile)) if len(parsedFile[i]) == len(parsedFile[0])]
+    haikuID = unratedRows[inNode[0]]
+    individualHaiku = parsedFile[dataLines[haikuID]]
+    haikuDict = parseHaiku("haikuDB")
+
+    rating = ""
+    while rating != "yes" or rating != "no":
+        print 
+        print haikuDict[haikuID]
+        rating = raw_input("Please rate this haiku.  Is it good?  Enter y/n: ")
+        #then we need to add this to our rating
+        if rating == "y":
+            individualHaiku[-1] = "yes"
+            break
+        if rating == "n":
+            individualHaiku[-1] = "no"
             break
+    if onlineTree is not None:
+        onlineTree.rate(haikuID, individualHaiku[-1])
 
-def ratePoem():
+def ratePoem(treeTimes=None):
+    '''
+    Asks for a text file holding a haiku and says whether the tree thinks it is any good.
+    treeTimes is anything with a search method (a DecisionTree or CompiledTree);
+    if it is not given, the model for haikuTable.txt is loaded (see getModel).
+    '''
+    if treeTimes is None:
+        treeTimes = getModel("haikuTable.txt")
     individualHaikuFile = raw_input("Please enter a txt file of the haiku you want rated.")
     individualHaiku = open(individualHaikuFile)
-    haikuDict = makeHaikuTable.parseHaiku(individualHaiku)
-    wordDict = makeHaikuTable.makeDictionary("wordDict.txt")
-    haikuFile = makeHaikuTable.makeTableFile(haikuDict, wordDict)
-    parsedHaiku = parseFile("haikuTable.txt")
-    print parsedHaiku
-    haikuDict = {}
-    for i in range(len(parsedHaiku[0])):
-        item =  parsedHaiku[0][i].strip()
-        if item == "av. word length":
-            item = "avgwordlength"
-        if item == "av. syllables":
-            item = "avgsyllables"
-        haikuDict[item] = parsedHaiku[1][i]
+    haiku = individualHaiku.read()
+    individualHaiku.close()
+    wordDict = openLexicon("wordDict.txt") #compiled the first time, only opened after that
+    haikuDict = getHaikuInfo(haiku, wordDict)
 
     print "Is your poem any good?", treeTimes.search(haikuDict)
 
+MODEL_CACHE = "modelCache" #directory that trained models are kept in
 
+def getModelKey(fileName, significance):
+    '''
+    Hashes the contents of a training table together with everything else that
+    decides what tree comes out of it, so a changed table gets a new model.
+    '''
+    dataFile = open(fileName, "rb")
+    sha = hashlib.sha1()
+    for block in iter(lambda: dataFile.read(1 << 20), b""):
+        sha.update(block)
+    dataFile.close()
+    sha.update("significance=%r model=%d" % (significance, MODEL_FORMAT_VERSION))
+    return sha.hexdigest()
+
+def getModel(fileName, significance=.05, cacheDir=MODEL_CACHE):
+    '''
+    Returns the pruned tree for the training table in fileName as a CompiledTree,
+    with its leave one out accuracy in its accuracy attribute.
+    The first time a table is seen the tree is trained, pruned and cross validated,
+    then saved in cacheDir under a hash of the table, so later calls with an
+    unchanged table just load it.
+    '''
+    modelFile = os.path.join(cacheDir, getModelKey(fileName, significance) + ".npz")
+    if os.path.exists(modelFile):
+        return loadCompiledTree(modelFile)
+
+    table = readTable(fileName)
+    tree = makeTree(table)
+    chiSquarePruning(tree, significance)
+    compiledTree = tree.compile(table.names)
+    compiledTree.accuracy = looCV(table)
+    if not os.path.isdir(cacheDir):
+        os.makedirs(cacheDir)
+    #write to a temporary file first so nobody ever loads half a model
+    tempFile = modelFile + ".%d.tmp" % os.getpid()
+    compiledTree.save(tempFile)
+    os.rename(tempFile, modelFile)
+    return compiledTree
                     
-def main():
+def drawTree(tree, accuracy, pdfFile="tree.pdf", dotFile="tree.dot"):
+    '''
+    Draws the tree into pdfFile by handing it straight to Graphviz's dot.
+    If dot can not be run, the tree is written to dotFile instead, to be drawn later.
+    Returns whether the pdf was made.
+    '''
+    try:
+        dot = subprocess.Popen(["dot", "-Tpdf", "-o", pdfFile], stdin=subprocess.PIPE)
+    except OSError:
+        print "Could not run dot (is Graphviz installed?), so the tree was written to", dotFile
+        tree.makeGraphViz(accuracy, dotFile)
+        return False
+    try:
+        tree.makeGraphViz(accuracy, dot.stdin)
+        dot.stdin.close()
+    except IOError:
+        pass #dot stopped reading, and has said why
+    return dot.wait() == 0
+
+def main(significance=.05):
+    from onlineTree import OnlineTree #onlineTree imports this module
     fileName = sys.argv[1]
     parsedFile = parseFile(fileName)
-    tree = makeTree(parsedFile)
-    chiSquarePruning(tree)
-    wordDict = makeDictionary("wordDict.txt")
+    compiledTree = getModel(fileName, significance)
+    tree = compiledTree.toDecisionTree()
     #haiku = raw_input("Please type a haiku (all on one line):   \n")
     #haikuInfo = getHaikuInfo(haiku, wordDict)
     #print "Is your poem any good?", tree.search(haikuInfo)
-    tree.makeGraphViz(looCV(parsedFile))
-    os.system("dot -Tpdf tree.dot -o tree.pdf")
-    os.system("open tree.pdf")
-
-    activeLearning(tree, parsedFile)
+    if drawTree(tree, compiledTree.accuracy):
+        os.system("open tree.pdf")
+
+    #the new rating goes into the online tree, which gives the updated
+    #model pruned the same way as getModel's, without training it again
+    onlineTree = OnlineTree(parsedFile)
+    activeLearning(tree, parsedFile, onlineTree)
+    tree = onlineTree.getPrunedTree(significance)
+    if drawTree(tree, None):
+        os.system("open tree.pdf")
     
 if __name__=="__main__":
     main()
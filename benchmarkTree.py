@@ -0,0 +1,262 @@
+'''
+Benchmarks for the decision tree code on synthetic haiku tables.
+
+Times splitData, makeTree, chiSquarePruning, looCV, k-fold crossValidate and
+searching the tree separately, for tables of 10^3 up to 10^6 rows, and writes
+the speed and peak memory of every step to a JSON file. Speeds are rows per
+second, except for pruning, which goes through the tree rather than the rows
+and is measured in nodes per second; the size of every tree is recorded too.
+Every step runs in its own forked process, so the memory numbers don't
+pile up from one step to the next.
+
+There are two kinds of table: "haiku", shaped like the real haiku tables,
+whose trees stay small however many rows there are, and "wide", with more
+attributes and wider ranges of values, whose trees keep growing with the rows.
+
+Run it as:  python benchmarkTree.py [--sizes 1000,10000] [--shapes haiku,wide] [--output bench.json] [--compare old.json]
+'''
+import sys, time, json, platform, resource, argparse, multiprocessing
+import numpy as np
+import ID3
+from dataTable import DataTable
+from makeHaikuTable import FEATURE_NAMES
+
+SIZES = [1000, 10000, 100000, 1000000]
+STAGES = ["splitData", "makeTree", "chiSquarePruning", "looCV", "kFold", "search", "predictBatch"]
+NODE_STAGES = ["chiSquarePruning"] #steps timed in nodes per second instead of rows
+SHAPES = ["haiku", "wide"]
+WIDE_ATTRS = 20 #attributes in a wide table
+MAX_LOOCV_ROWS = 100000 #leave one out gets slow past this
+MAX_SEARCH_ROWS = 100000 #search goes one item at a time, so only this many are timed
+
+def makeSyntheticData(numRows, seed=0):
+    '''
+    Makes a table that looks like the haiku tables: small integer counts for
+    each feature, and a noisy yes/no rating that depends on a few of them.
+    About a fifth of the rows are left unrated.
+    Returns (features, labels) as arrays, see DataTable.setColumns.
+    '''
+    random = np.random.RandomState(seed)
+    features = np.column_stack([random.randint(0, 13, numRows), #nouns
+                                random.randint(0, 8, numRows), #verbs
+                                random.randint(0, 7, numRows), #adjectives
+                                random.randint(1, 4, numRows), #avgsyllables
+                                random.randint(3, 9, numRows)]) #avgwordlength
+    score = features[:, 0] + features[:, 1] - features[:, 2] + random.randint(0, 7, numRows)
+    labels = (score > 12).astype(np.int8)
+    labels[random.rand(numRows) < .2] = -1
+    return features, labels
+
+def makeWideData(numRows, seed=0):
+    '''
+    Makes a table with WIDE_ATTRS attributes valued 0 to 99, and a noisy yes/no
+    rating that mixes eight of them (some only past a threshold of another).
+    The splits needed to follow it never run out, so the more rows there
+    are, the bigger the tree gets. About a fifth of the rows are left unrated.
+    Returns (features, labels) as arrays, see DataTable.setColumns.
+    '''
+    random = np.random.RandomState(seed)
+    features = random.randint(0, 100, (numRows, WIDE_ATTRS))
+    score = features[:, 0] + features[:, 1] - features[:, 2] + \
+            np.where(features[:, 3] > 50, features[:, 4], -features[:, 5]) + \
+            features[:, 6] * features[:, 7] // 50 + random.normal(0, 15, numRows)
+    labels = (score > np.median(score)).astype(np.int8)
+    labels[random.rand(numRows) < .2] = -1
+    return features, labels
+
+def getSyntheticData(numRows, seed=0, shape="haiku"):
+    '''
+    Returns (names, features, labels) for a table of the given shape, see SHAPES.
+    '''
+    if shape == "haiku":
+        return (FEATURE_NAMES,) + makeSyntheticData(numRows, seed)
+    if shape == "wide":
+        return (["attr%d" % j for j in range(WIDE_ATTRS)],) + makeWideData(numRows, seed)
+    raise ValueError("unknown shape " + shape)
+
+def makeSyntheticTable(numRows, seed=0, shape="haiku"):
+    names, features, labels = getSyntheticData(numRows, seed, shape)
+    table = DataTable()
+    table.setColumns(names, "Outcome", features, labels)
+    return table
+
+def makeSyntheticRows(numRows, seed=0, shape="haiku"):
+    '''
+    The same data as makeSyntheticTable, as the list of lists parseFile would give.
+    '''
+    names, features, labels = getSyntheticData(numRows, seed, shape)
+    outcomes = {1: "yes", 0: "no", -1: "None"}
+    data = [names + ["Outcome"]]
+    for i in range(numRows):
+        data.append([str(value) for value in features[i]] + [outcomes[labels[i]]])
+    return data
+
+def getCurrentMemory():
+    '''
+    Resident memory of this process in MB, or 0 where /proc is not available.
+    '''
+    try:
+        statm = open("/proc/self/statm")
+        pages = int(statm.read().split()[1])
+        statm.close()
+        return pages * resource.getpagesize() / float(1 << 20)
+    except IOError:
+        return 0.0
+
+def getPeakMemory():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / float(1 << 20) #bytes on a mac
+    return peak / 1024.0 #kilobytes on linux
+
+def countNodes(tree):
+    return sum(1 for node, depth in tree.breadthFirst())
+
+def runStage(stage, numRows, shape="haiku"):
+    '''
+    Sets up and times one step. Returns a dictionary with the seconds it took,
+    the number of rows it went through (rowsTimed) and, for the steps that
+    have a tree, the number of nodes in it (for pruning, before and after).
+    '''
+    if stage == "splitData":
+        data = makeSyntheticRows(numRows, shape=shape)
+        start = time.time()
+        ID3.splitData(data)
+        return {"seconds": time.time() - start, "rowsTimed": numRows}
+
+    table = makeSyntheticTable(numRows, shape=shape)
+    if stage == "makeTree":
+        start = time.time()
+        tree = ID3.makeTree(table)
+        return {"seconds": time.time() - start, "rowsTimed": numRows, "nodes": countNodes(tree)}
+    if stage == "chiSquarePruning":
+        tree = ID3.makeTree(table)
+        numNodes = countNodes(tree)
+        ID3.getCriticalValue(1, .05) #so the time to import scipy isn't counted
+        start = time.time()
+        ID3.chiSquarePruning(tree)
+        return {"seconds": time.time() - start, "rowsTimed": numRows, "nodes": numNodes,
+                "nodesLeft": countNodes(tree)}
+    if stage == "looCV":
+        start = time.time()
+        ID3.looCV(table)
+        return {"seconds": time.time() - start, "rowsTimed": numRows}
+    if stage == "kFold":
+        start = time.time()
+        ID3.crossValidate(table, 10)
+        return {"seconds": time.time() - start, "rowsTimed": numRows}
+
+    tree = ID3.makeTree(table)
+    ID3.chiSquarePruning(tree)
+    if stage == "search":
+        numItems = min(numRows, MAX_SEARCH_ROWS)
+        items = [table.getItem(row) for row in range(numItems)]
+        start = time.time()
+        for itemDict in items:
+            tree.search(itemDict)
+        return {"seconds": time.time() - start, "rowsTimed": numItems, "nodes": countNodes(tree)}
+    if stage == "predictBatch":
+        features = table.getFeatures()
+        compiledTree = tree.compile(table.names)
+        start = time.time()
+        compiledTree.predictBatch(features)
+        return {"seconds": time.time() - start, "rowsTimed": numRows, "nodes": countNodes(tree)}
+    raise ValueError("unknown stage " + stage)
+
+def getSpeed(result):
+    '''
+    Returns (speed, unit) for a result: nodes per second for NODE_STAGES, rows per second otherwise.
+    '''
+    if "nodesPerSecond" in result:
+        return result["nodesPerSecond"], "nodes/sec"
+    return result["rowsPerSecond"], "rows/sec"
+
+def measureStage(stage, numRows, shape, connection):
+    startMemory = getCurrentMemory()
+    result = runStage(stage, numRows, shape)
+    result.update({"stage": stage, "rows": numRows, "shape": shape,
+                   "peakMemoryMB": getPeakMemory(), "startMemoryMB": startMemory})
+    if stage in NODE_STAGES:
+        result["nodesPerSecond"] = result["nodes"] / max(result["seconds"], 1e-9)
+    else:
+        result["rowsPerSecond"] = result["rowsTimed"] / max(result["seconds"], 1e-9)
+    connection.send(result)
+    connection.close()
+
+def benchmark(stage, numRows, shape="haiku"):
+    '''
+    Runs one step in a child process and returns its result dictionary.
+    If the child dies without sending one (it raised, or ran out of memory),
+    the result just says the step failed.
+    '''
+    parentEnd, childEnd = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(target=measureStage, args=(stage, numRows, shape, childEnd))
+    process.start()
+    childEnd.close() #so recv sees the end of the pipe when the child exits
+    try:
+        result = parentEnd.recv()
+    except EOFError:
+        result = None
+    process.join()
+    if result is None:
+        result = {"stage": stage, "rows": numRows, "shape": shape, "failed": True, "exitcode": process.exitcode}
+    return result
+
+def compare(results, oldFileName):
+    '''
+    Prints how the speed of every step changed since the results in oldFileName.
+    Results from before there were shapes are taken to be haiku tables.
+    '''
+    oldFile = open(oldFileName)
+    oldResults = json.load(oldFile)["results"]
+    oldFile.close()
+    old = dict(((result["stage"], result["rows"], result.get("shape", "haiku")), result)
+               for result in oldResults)
+    print
+    print "%-18s %6s %10s %12s" % ("step", "shape", "rows", "speedup")
+    for result in results:
+        key = (result["stage"], result["rows"], result["shape"])
+        if key in old and "failed" not in result and "failed" not in old[key]:
+            speed, unit = getSpeed(result)
+            oldSpeed, oldUnit = getSpeed(old[key])
+            if unit == oldUnit:
+                print "%-18s %6s %10d %11.2fx" % (key[0], key[2], key[1], speed / oldSpeed)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the decision tree code.")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in SIZES),
+                        help="comma separated numbers of rows")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma separated steps to time")
+    parser.add_argument("--shapes", default=",".join(SHAPES), help="comma separated kinds of table")
+    parser.add_argument("--output", default="bench_output.json", help="where to write the results")
+    parser.add_argument("--compare", help="results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    results = []
+    print "%-18s %6s %10s %8s %10s %14s %10s" % ("step", "shape", "rows", "nodes", "seconds", "speed", "peak MB")
+    for shape in args.shapes.split(","):
+        for numRows in [int(size) for size in args.sizes.split(",")]:
+            for stage in args.stages.split(","):
+                if stage == "looCV" and numRows > MAX_LOOCV_ROWS:
+                    continue
+                result = benchmark(stage, numRows, shape)
+                results.append(result)
+                if "failed" in result:
+                    print "%-18s %6s %10d     failed (exit code %s)" % (stage, shape, numRows, result["exitcode"])
+                    continue
+                speed, unit = getSpeed(result)
+                print "%-18s %6s %10d %8s %10.3f %14.0f %10.1f  %s" % (stage, shape, numRows, result.get("nodes", "-"),
+                                                                     result["seconds"], speed,
+                                                                     result["peakMemoryMB"], unit)
+
+    output = {"python": platform.python_version(), "numpy": np.__version__,
+              "machine": platform.machine(), "cores": multiprocessing.cpu_count(),
+              "time": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results}
+    outputFile = open(args.output, "w")
+    json.dump(output, outputFile, indent=1)
+    outputFile.close()
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__=="__main__":
+    main()
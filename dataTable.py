@@ -0,0 +1,354 @@
+'''
+Holly French and Alexandra Price
+
+This file contains the DataTable class, a columnar copy of a parsed
+dataset that the decision tree code uses to count outcomes quickly.
+'''
+import os, copy, json
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+
+TABLE_MAGIC = "HAIKU TABLE 1\n" #first line of a binary table file
+
+class DataTable:
+    '''
+    Turns the list of lists made by ID3.parseFile (first row is the names
+    of the attributes, last column is the outcome) into integer NumPy columns.
+
+    Every attribute value is replaced by the index of its level, where the
+    levels of all the attributes are laid out one after another:
+    attribute j owns levels offsets[j] up to offsets[j+1], sorted by value.
+    This way the yes/no counts for every attribute come out of one bincount.
+    '''
+    def __init__(self, data=None):
+        if data is None:
+            return #filled in by setColumns or loadTable
+        header = data[0]
+        rows = [row for row in data[1:] if len(row) == len(header)] #skips blank lines
+        cells = np.array(rows, dtype=str).reshape(len(rows), len(header))
+        outcomes = cells[:, -1]
+        #1 for yes, 0 for no, -1 for anything else (unrated poems)
+        labels = np.full(len(rows), -1, dtype=np.int8)
+        labels[outcomes == "yes"] = 1
+        labels[outcomes == "no"] = 0
+        self.setColumns(header[:-1], header[-1], cells[:, :-1].astype(np.int64), labels)
+
+    def setColumns(self, names, outcomeName, features, labels):
+        '''
+        Fills in the table from a 2-D integer array of attribute values
+        (one row per data row, one column per name) and an array of labels
+        (1 for yes, 0 for no, -1 for unrated).
+        '''
+        self.names = list(names)
+        self.outcomeName = outcomeName
+        self.numRows = len(labels)
+        self.labels = np.asarray(labels, dtype=np.int8)
+        numAttrs = len(self.names)
+        features = np.asarray(features).reshape(self.numRows, numAttrs)
+
+        allLevels = []
+        allCodes = []
+        self.offsets = np.zeros(numAttrs + 1, dtype=np.int64)
+        for j in range(numAttrs):
+            attrLevels, codes = findLevels(features[:, j])
+            allCodes.append(codes + self.offsets[j])
+            self.offsets[j + 1] = self.offsets[j] + len(attrLevels)
+            allLevels.append(attrLevels)
+        self.codes = np.empty((numAttrs, self.numRows), dtype=getCodeType(self.offsets[-1]))
+        for j in range(numAttrs):
+            self.codes[j] = allCodes[j]
+        if allLevels:
+            self.levels = np.concatenate(allLevels).astype(np.int64)
+        else:
+            self.levels = np.zeros(0, dtype=np.int64)
+
+    def save(self, fileName):
+        '''
+        Writes the table in the binary format loadTable reads: a line saying what
+        the file is, a line of JSON describing the columns, and then the codes,
+        labels, levels and offsets arrays as raw bytes, each starting on a
+        multiple of 64 bytes so they can be memory mapped straight from the file.
+        '''
+        arrays = [("codes", np.ascontiguousarray(self.codes)), ("labels", self.labels),
+                  ("levels", self.levels), ("offsets", self.offsets)]
+        #write to a temporary file first: loadTable maps the file, so writing over
+        #a table someone has open would pull the pages out from under them
+        tempFile = fileName + ".%d.tmp" % os.getpid()
+        tableFile = open(tempFile, "wb")
+        schema = writeTableHeader(tableFile, self.names, self.outcomeName, self.numRows,
+                                  [(name, array.dtype, array.shape) for name, array in arrays])
+        for name, array in arrays:
+            tableFile.seek(schema[name]["start"])
+            tableFile.write(array.tobytes())
+        tableFile.close()
+        os.rename(tempFile, fileName)
+
+    def share(self):
+        '''
+        Returns a copy of the table whose codes and labels live in shared memory.
+        Worker processes that are handed the copy when they start (for example
+        through the initargs of a multiprocessing.Pool) all read the same pages
+        instead of each getting their own pickled copy.
+        '''
+        shared = copy.copy(self)
+        shared.sharedCodes = RawArray("b", self.codes.nbytes)
+        shared.sharedLabels = RawArray("b", self.labels.size)
+        shared.attachShared()
+        shared.codes[:] = self.codes
+        shared.labels[:] = self.labels
+        return shared
+
+    def attachShared(self):
+        codeType = getCodeType(self.offsets[-1])
+        self.codes = np.frombuffer(self.sharedCodes, dtype=codeType).reshape(len(self.names), self.numRows)
+        self.labels = np.frombuffer(self.sharedLabels, dtype=np.int8)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if "sharedCodes" in state:
+            #the shared arrays get passed along, not the arrays viewing them
+            del state["codes"]
+            del state["labels"]
+        if "binnedTables" in state:
+            del state["binnedTables"] #easier to bin again than to send
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "sharedCodes" in state:
+            self.attachShared()
+
+    def binned(self, maxBins):
+        '''
+        Returns a copy of the table where each attribute has at most maxBins levels.
+        Neighbouring levels are merged so that the bins hold about the same
+        number of rows (a level with more rows than that gets a bin to itself),
+        and each bin takes the largest value in it, so a split "<= value" of the
+        binned table splits the original values exactly the same way.
+        Only the codes are new: the labels are the same array as this table's,
+        so new ratings show up in both. The copy is made once per maxBins and kept.
+        '''
+        if "binnedTables" not in self.__dict__:
+            self.binnedTables = {}
+        if maxBins in self.binnedTables:
+            return self.binnedTables[maxBins]
+        numAttrs = len(self.names)
+        counts = np.bincount(self.codes.ravel(), minlength=self.getNumLevels())
+        levelToBin = np.zeros(self.getNumLevels(), dtype=np.int64) #new code of every old level
+        offsets = np.zeros(numAttrs + 1, dtype=np.int64)
+        allLevels = []
+        for j in range(numAttrs):
+            start = self.offsets[j]
+            end = self.offsets[j + 1]
+            if start == end: #an empty table has no levels
+                offsets[j + 1] = offsets[j]
+                allLevels.append(self.levels[start:end])
+                continue
+            attrCounts = counts[start:end]
+            #which share of the rows come before each level decides its bin
+            before = np.cumsum(attrCounts) - attrCounts
+            bins = before * maxBins // max(attrCounts.sum(), 1)
+            bins = np.unique(bins, return_inverse=True)[1]
+            levelToBin[start:end] = offsets[j] + bins
+            offsets[j + 1] = offsets[j] + bins[-1] + 1
+            #levels are sorted, so the last level in a bin is its largest value
+            lastInBin = np.r_[bins[1:] != bins[:-1], True]
+            allLevels.append(self.levels[start:end][lastInBin])
+
+        table = copy.copy(self) #__getstate__ leaves out binnedTables
+        table.offsets = offsets
+        table.levels = np.concatenate(allLevels).astype(np.int64)
+        table.codes = levelToBin[self.codes].astype(getCodeType(offsets[-1]))
+        for name in ["sharedCodes", "sharedLabels"]:
+            if name in table.__dict__:
+                del table.__dict__[name] #the binned codes are not shared
+        self.binnedTables[maxBins] = table
+        return table
+
+    def getNumLevels(self):
+        return int(self.offsets[-1])
+
+    def getLevels(self, attrIndex):
+        '''
+        Returns the sorted distinct values of one attribute.
+        '''
+        return self.levels[self.offsets[attrIndex]:self.offsets[attrIndex + 1]]
+
+    def getFeatures(self, rows=None):
+        '''
+        Returns the attribute values as a 2-D array with one row per data row
+        (only the given rows, if any) and one column per attribute in names.
+        '''
+        codes = self.codes
+        if rows is not None:
+            codes = codes[:, rows]
+        return self.levels[codes.T]
+
+    def getItem(self, row):
+        '''
+        Returns the attribute values of one row as a dictionary,
+        the form DecisionTree.search takes: {attr1: value, attr2: value, etc}
+        '''
+        itemDict = {}
+        for j in range(len(self.names)):
+            itemDict[self.names[j]] = self.levels[self.codes[j, row]]
+        return itemDict
+
+    def getOutcome(self, row):
+        '''
+        Returns the outcome of a row the way the tree spells it ("YES" or "NO"),
+        or None if the row is not rated.
+        '''
+        if self.labels[row] == 1:
+            return "YES"
+        elif self.labels[row] == 0:
+            return "NO"
+        return None
+
+    def allRows(self):
+        return np.arange(self.numRows)
+
+    def countLevels(self, rows=None):
+        '''
+        Counts the yes and no outcomes at every level of every attribute,
+        using only the given row indices (or every row if rows is None).
+        Rows without a yes/no outcome are not counted.
+
+        Returns two arrays (numYes, numNo), each with one slot per level.
+        '''
+        codes = self.codes
+        labels = self.labels
+        if rows is not None:
+            codes = codes[:, rows]
+            labels = labels[rows]
+        rated = labels >= 0
+        cells = codes[:, rated].astype(np.intp) * 2 + labels[rated]
+        counts = np.bincount(cells.ravel(), minlength=2 * self.getNumLevels())
+        counts = counts.reshape(-1, 2)
+        return counts[:, 1], counts[:, 0]
+
+def findLevels(column):
+    '''
+    Same as np.unique(column, return_inverse=True). Columns of small
+    non-negative counts, which is what the haiku features are, are done
+    with a bincount instead of sorting.
+    '''
+    column = np.asarray(column)
+    if np.issubdtype(column.dtype, np.integer) and len(column) > 0 and column.min() >= 0 and column.max() < 1 << 16:
+        present = np.bincount(column) > 0
+        levelIndex = np.cumsum(present) - 1
+        return np.flatnonzero(present).astype(column.dtype), levelIndex[column]
+    return np.unique(column, return_inverse=True)
+
+def getCodeType(numLevels):
+    '''
+    The smallest unsigned integer type that can hold the level codes.
+    '''
+    for codeType in [np.uint8, np.uint16, np.uint32]:
+        if numLevels <= np.iinfo(codeType).max + 1:
+            return codeType
+    return np.uint64
+
+def writeTableHeader(tableFile, names, outcomeName, numRows, arrays):
+    '''
+    Writes the first two lines of a binary table, see DataTable.save.
+    arrays is a list of (name, dtype, shape) in the order they go in the file.
+    Returns the schema, which says where each array starts.
+    '''
+    schema = {"names": names, "outcomeName": outcomeName, "numRows": numRows}
+    #the header has to know where the arrays start, so work out its size first
+    position = 1 << 12
+    for name, dtype, shape in arrays:
+        dtype = np.dtype(dtype)
+        schema[name] = {"dtype": dtype.str, "shape": list(shape), "start": position}
+        position = alignTo(position + dtype.itemsize * int(np.prod(shape)))
+    header = TABLE_MAGIC + json.dumps(schema) + "\n"
+    if len(header) > 1 << 12:
+        raise ValueError("too many attributes to fit the table header")
+    tableFile.write(header)
+    return schema
+
+def saveUnratedTable(fileName, names, outcomeName, readBlocks):
+    '''
+    Writes the file DataTable.save would for a table with the given attribute
+    values and no rated rows, without ever holding all the rows.
+    readBlocks is a function returning an iterator over 2-D integer arrays,
+    the rows in order, one column per name. It is called twice: once to find
+    the levels of every attribute and once to write the codes block by block.
+    Returns the number of rows.
+    '''
+    numAttrs = len(names)
+    attrLevels = [np.zeros(0, dtype=np.int64) for j in range(numAttrs)]
+    numRows = 0
+    for block in readBlocks():
+        block = np.asarray(block).reshape(-1, numAttrs)
+        numRows += len(block)
+        for j in range(numAttrs):
+            attrLevels[j] = np.union1d(attrLevels[j], findLevels(block[:, j])[0]).astype(np.int64)
+    offsets = np.zeros(numAttrs + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(levels) for levels in attrLevels])
+    levels = np.concatenate(attrLevels)
+    codeType = np.dtype(getCodeType(offsets[-1]))
+
+    tempFile = fileName + ".%d.tmp" % os.getpid() #see DataTable.save
+    tableFile = open(tempFile, "wb")
+    schema = writeTableHeader(tableFile, list(names), outcomeName, numRows,
+                              [("codes", codeType, (numAttrs, numRows)), ("labels", np.int8, (numRows,)),
+                               ("levels", levels.dtype, levels.shape), ("offsets", offsets.dtype, offsets.shape)])
+    row = 0
+    for block in readBlocks():
+        block = np.asarray(block).reshape(-1, numAttrs)
+        for j in range(numAttrs):
+            #codes are stored a whole attribute after another, so each block goes in numAttrs pieces
+            codes = np.searchsorted(attrLevels[j], block[:, j]) + offsets[j]
+            tableFile.seek(schema["codes"]["start"] + (j * numRows + row) * codeType.itemsize)
+            tableFile.write(codes.astype(codeType).tobytes())
+        tableFile.seek(schema["labels"]["start"] + row)
+        tableFile.write(np.full(len(block), -1, dtype=np.int8).tobytes())
+        row += len(block)
+    for name, array in [("levels", levels), ("offsets", offsets)]:
+        tableFile.seek(schema[name]["start"])
+        tableFile.write(array.tobytes())
+    tableFile.close()
+    os.rename(tempFile, fileName)
+    return numRows
+
+def alignTo(position, alignment=64):
+    return (position + alignment - 1) // alignment * alignment
+
+def isTableFile(fileName):
+    '''
+    Checks whether fileName is a binary table written by DataTable.save.
+    '''
+    tableFile = open(fileName, "rb")
+    start = tableFile.read(len(TABLE_MAGIC))
+    tableFile.close()
+    return start == TABLE_MAGIC
+
+def loadTable(fileName):
+    '''
+    Opens a table written by DataTable.save. Nothing is parsed or copied:
+    the arrays are memory mapped from the file, so this takes the same time
+    for any number of rows. Changes (like new ratings) stay in memory and
+    are not written back to the file.
+    '''
+    tableFile = open(fileName, "rb")
+    if tableFile.readline() != TABLE_MAGIC:
+        tableFile.close()
+        raise ValueError(fileName + " is not a binary table")
+    schema = json.loads(tableFile.readline())
+    tableFile.close()
+
+    table = DataTable()
+    table.names = [str(name) for name in schema["names"]]
+    table.outcomeName = str(schema["outcomeName"])
+    table.numRows = schema["numRows"]
+    for name in ["codes", "labels", "levels", "offsets"]:
+        info = schema[name]
+        shape = tuple(info["shape"])
+        if 0 in shape:
+            array = np.zeros(shape, dtype=info["dtype"]) #mmap can not map nothing
+        else:
+            array = np.memmap(fileName, dtype=info["dtype"], mode="c", offset=info["start"], shape=shape)
+        setattr(table, name, array)
+    return table
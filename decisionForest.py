@@ -0,0 +1,106 @@
+'''
+Holly French and Alexandra Price
+
+This file contains the class for a bagged forest of decision trees,
+and the functions that train one in parallel.
+'''
+import math
+import numpy as np
+from numericTreeClass import *
+from dataTable import DataTable
+from workerPool import runTasks
+import ID3
+
+class DecisionForest:
+    '''
+    A bunch of CompiledTrees, each trained on a bootstrap sample of the data
+    with a random subset of the attributes, that vote on the outcome.
+    It has the same search method as DecisionTree, so it can be used
+    anywhere a tree is searched (ratePoem, for example).
+    '''
+    def __init__(self, trees, names):
+        self.trees = trees
+        self.names = list(names)
+
+    def getTrees(self):
+        return self.trees
+
+    def predictBatch(self, features):
+        '''
+        Classifies every row of a 2-D feature matrix (one column per attribute in names)
+        by majority vote of the trees. Returns an array with 1 for "YES", 0 for "NO",
+        and -1 where none of the trees had a branch for the row. Ties go to "NO".
+        '''
+        features = np.asarray(features)
+        numYes = np.zeros(len(features), dtype=np.int32)
+        numNo = np.zeros(len(features), dtype=np.int32)
+        for tree in self.trees:
+            outcomes = tree.predictBatch(features)
+            numYes += outcomes == 1
+            numNo += outcomes == 0
+        outcomes = np.full(len(features), -1, dtype=np.int8)
+        outcomes[numNo + numYes > 0] = 0
+        outcomes[numYes > numNo] = 1
+        return outcomes
+
+    def search(self, itemDict):
+        '''
+        Same as DecisionTree.search: takes {attr1: value, attr2:value, etc}
+        and returns "YES" or "NO", or None if no tree has a branch for the item.
+        '''
+        features = np.array([[int(itemDict[name]) for name in self.names]])
+        outcome = self.predictBatch(features)[0]
+        if outcome == 1:
+            return "YES"
+        elif outcome == 0:
+            return "NO"
+        return None
+
+forestTable = None #the DataTable a forest worker process trains on
+
+def initForestWorker(table):
+    global forestTable
+    forestTable = table
+
+def trainForestTree(args):
+    '''
+    Trains one tree of the forest on forestTable (see initForestWorker).
+    The bootstrap sample and the attributes come from a RandomState seeded with seed,
+    so a tree only depends on its seed, not on which process trains it.
+    '''
+    seed, numFeatures, prune, significance = args
+    random = np.random.RandomState(seed)
+    ratedRows = forestTable.allRows()[forestTable.labels >= 0]
+    rows = np.sort(random.choice(ratedRows, len(ratedRows)))
+    attributes = random.choice(len(forestTable.names), numFeatures, replace=False)
+    tree = ID3.makeTree(forestTable, rows, attributes)
+    if prune:
+        ID3.chiSquarePruning(tree, significance)
+    compiledTree = tree.compile(forestTable.names)
+    #the Nodes stay behind, only the arrays go back to the parent process
+    compiledTree.nodes = None
+    compiledTree.nodeIndex = {}
+    return compiledTree
+
+def makeForest(dataSet, numTrees=25, numFeatures=None, seed=0, prune=True, significance=.05, numProcesses=None):
+    '''
+    Trains a DecisionForest of numTrees trees, each with makeTree on a bootstrap sample
+    of the rated rows, using numFeatures attributes picked at random
+    (by default the square root of the number of attributes, but at least 2),
+    and pruned with chiSquarePruning unless prune is False.
+
+    The trees are trained by workerPool.runTasks with numProcesses processes. The table is
+    put in shared memory and given to every worker once. The same seed always gives the same forest.
+    '''
+    if isinstance(dataSet, DataTable):
+        table = dataSet
+    else:
+        table = DataTable(dataSet)
+    numAttrs = len(table.names)
+    if numFeatures is None:
+        numFeatures = max(2, int(math.ceil(math.sqrt(numAttrs))))
+    numFeatures = min(numFeatures, numAttrs)
+    treeSeeds = np.random.RandomState(seed).randint(0, 2**31 - 1, numTrees)
+    tasks = [(int(treeSeed), numFeatures, prune, significance) for treeSeed in treeSeeds]
+    trees = list(runTasks(trainForestTree, tasks, initForestWorker, (table,), numProcesses))
+    return DecisionForest(trees, table.names)
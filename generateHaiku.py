@@ -1,5 +1,7 @@
 import random
 import re
+import numpy as np
+from lexicon import openLexicon, POS_CODES
 from syllableCount import *
 
 def makeSyllableDict(wordList):
@@ -13,26 +15,20 @@ def makeSyllableDict(wordList):
 			syllDict[numSyll] = [wordTup[0]]
 	return syllDict
 
-def makePOSDict(fileName):
-	"""Helps us efficiently parse parts of speech"""
-	wordFile = open(fileName)
+def makePOSDict(fileName, posFile=None):
+	"""Helps us efficiently parse parts of speech.
+	Works from the compiled lexicon (see lexicon.py), so wordDict.txt is only
+	parsed the first time; words of more than 7 syllables, or whose syllables
+	are not known, are left out"""
+	lexicon = openLexicon(fileName, posFile)
+	usable = (lexicon.syllables >= 1) & (lexicon.syllables <= 7)
 	POSDict = {}
-	for line in wordFile:
-		line = line.strip()
-		line = line.split()
-		word = line[0]
-		POS = line[1]
-		numSyll = int(line[-1])
-		for part in POS:
-			if numSyll <= 7:
-				if part in POSDict:
-					POSDict[part].append((word, numSyll))
-				else:
-					POSDict[part] = [(word, numSyll)]
-	for POS in POSDict:
-		wordList = POSDict[POS]
-		syllDict = makeSyllableDict(wordList)
-		POSDict[POS] = syllDict
+	for part in POS_CODES:
+		indexes = np.flatnonzero(lexicon.hasPOS(part) & usable)
+		indexes = indexes[np.argsort(lexicon.order[indexes], kind="mergesort")] #in the order of the file
+		if len(indexes) > 0:
+			wordList = [(lexicon.getWord(i), int(lexicon.syllables[i])) for i in indexes]
+			POSDict[part] = makeSyllableDict(wordList)
 	return POSDict
 
 
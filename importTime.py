@@ -0,0 +1,60 @@
+'''
+Measures how long it takes to load the decision tree code and rate a haiku,
+each time in a fresh python process, and checks that scipy was never loaded.
+
+Run it as:  python importTime.py [number of runs]
+'''
+import sys, subprocess
+
+#each of these is run in its own process and prints its time in seconds
+IMPORT_TREE = '''
+import sys, time
+start = time.time()
+import ID3
+print time.time() - start, "scipy" in sys.modules
+'''
+
+RATE_HAIKU = '''
+import sys, time
+start = time.time()
+import ID3
+table = ID3.DataTable(ID3.parseFile("haikuTable.txt"))
+tree = ID3.makeTree(table)
+tree.search(table.getItem(0))
+print time.time() - start, "scipy" in sys.modules
+'''
+
+IMPORT_SCIPY = '''
+import sys, time
+start = time.time()
+import numpy
+from scipy.stats import chi2
+print time.time() - start, "scipy" in sys.modules
+'''
+
+def timeScript(script, numRuns):
+    '''
+    Runs the script numRuns times, returns the median time
+    and whether scipy got loaded in any of the runs.
+    '''
+    times = []
+    loadedScipy = False
+    for i in range(numRuns):
+        output = subprocess.check_output([sys.executable, "-c", script]).split()
+        times.append(float(output[0]))
+        loadedScipy = loadedScipy or output[1] == "True"
+    times.sort()
+    return times[len(times) // 2], loadedScipy
+
+def main():
+    if len(sys.argv) > 1:
+        numRuns = int(sys.argv[1])
+    else:
+        numRuns = 5
+    for name, script in [("import ID3", IMPORT_TREE), ("import ID3 + rate a haiku", RATE_HAIKU),
+                         ("import scipy.stats (what ID3 used to pay)", IMPORT_SCIPY)]:
+        seconds, loadedScipy = timeScript(script, numRuns)
+        print "%-45s %8.1f ms   scipy loaded: %s" % (name, seconds * 1000, loadedScipy)
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,294 @@
+'''
+A compiled lexicon: the words of wordDict.txt (and, if asked for, every word
+in mobypos.txt) with their parts of speech and syllable counts, written once
+into a binary file that is memory mapped instead of parsed.
+
+The file holds the words sorted and packed end to end, a hash table pointing
+into them, and for each word a bitmask of its parts of speech and a byte with
+its syllable count. Opening it reads nothing but the header, looking a word up
+costs the same for any size of lexicon, and every process that opens the file
+shares the same pages of memory.
+
+Most code gets one through openLexicon, which compiles the text files the first
+time (and again whenever they change):
+
+    wordDict = openLexicon("wordDict.txt")
+    pos, syllables = wordDict["able"]
+'''
+import os, json, mmap, struct, zlib, hashlib
+import numpy as np
+
+LEXICON_MAGIC = "HAIKU LEXICON 2\n" #first line of a compiled lexicon
+LEXICON_EXTENSION = ".lex"
+POS_CODES = "NphVtiAvCP!rDIo" #the parts of speech mobypos.txt uses, one bit each
+
+def getPOSMask(pos):
+    '''
+    Turns a string of part of speech letters, like "VtN", into a bitmask.
+    Letters that are not in POS_CODES are left out.
+    '''
+    mask = 0
+    for part in pos:
+        index = POS_CODES.find(part)
+        if index >= 0:
+            mask |= 1 << index
+    return mask
+
+def getPOSString(mask):
+    '''
+    Turns a bitmask back into a string of part of speech letters, in the order of POS_CODES.
+    '''
+    return "".join([part for i, part in enumerate(POS_CODES) if mask >> i & 1])
+
+def readWordDict(fileName):
+    '''
+    Yields (word, pos, syllables) for every line of a file like wordDict.txt.
+    '''
+    wordFile = open(fileName)
+    for line in wordFile:
+        line = line.split()
+        if line:
+            yield line[0], line[1], int(line[-1])
+    wordFile.close()
+
+def readMobyPOS(fileName):
+    '''
+    Yields (word, pos) for every line of mobypos.txt, where lines look like
+    "word\\POS". Some of the words are phrases with spaces in them.
+    '''
+    wordFile = open(fileName, "rb")
+    for line in wordFile:
+        line = line.rstrip("\r\n")
+        if "\\" in line:
+            word, pos = line.rsplit("\\", 1)
+            yield word, pos
+    wordFile.close()
+
+def getHash(word):
+    return zlib.crc32(word) & 0xffffffff
+
+def compileLexicon(fileName, wordDictFile="wordDict.txt", posFile=None):
+    '''
+    Writes the words of wordDictFile, and of posFile (mobypos.txt) if it is
+    given, into a compiled lexicon called fileName.
+    mobypos.txt has no syllable counts, so its words that are not in
+    wordDictFile get 0 syllables, which is what a word that is not in the
+    dictionary has always counted for.
+    '''
+    entries = {}
+    for word, pos, syllables in readWordDict(wordDictFile):
+        entries[word] = [getPOSMask(pos), syllables, len(entries)]
+    if posFile is not None:
+        fromWordDict = set(entries)
+        for word, pos in readMobyPOS(posFile):
+            if word not in fromWordDict:
+                #a few words are listed more than once, so their parts of speech add up
+                entries.setdefault(word, [0, 0, len(entries)])[0] |= getPOSMask(pos)
+    writeLexicon(fileName, entries)
+
+def getEntries(dictionaryDict):
+    '''
+    Turns a dictionary {word: (pos, syllables)} into the entries writeLexicon takes.
+    '''
+    entries = {}
+    for word, (pos, syllables) in dictionaryDict.items():
+        entries[word] = [getPOSMask(pos), syllables, len(entries)]
+    return entries
+
+def getEntriesHash(words, posMasks, syllables):
+    '''
+    A hash of what the sorted words mean (parts of speech and syllables),
+    which two lexicons share exactly when they would give the same features.
+    '''
+    sha = hashlib.sha1()
+    for word, mask, numSyll in zip(words, posMasks.tolist(), syllables.tolist()):
+        sha.update("%s\t%s\t%d\n" % (word, getPOSString(mask), numSyll))
+    return sha.hexdigest()
+
+def getLexiconHash(dictionaryDict):
+    '''
+    The getEntriesHash of a Lexicon (kept in its file) or of a plain dictionary.
+    '''
+    if isinstance(dictionaryDict, Lexicon):
+        return dictionaryDict.contentHash
+    words = sorted(dictionaryDict)
+    posMasks = np.array([getPOSMask(dictionaryDict[word][0]) for word in words], dtype=np.uint16)
+    syllables = np.array([min(dictionaryDict[word][1], 255) for word in words], dtype=np.uint8)
+    return getEntriesHash(words, posMasks, syllables)
+
+def writeLexicon(fileName, entries):
+    '''
+    Writes a compiled lexicon from a dictionary {word: [posMask, syllables, order]},
+    where order is the position of the word in the files it came from.
+    '''
+    words = sorted(entries)
+    lengths = np.fromiter(map(len, words), np.int64, len(words))
+    offsets = np.zeros(len(words) + 1, dtype=np.uint32)
+    offsets[1:] = np.cumsum(lengths)
+    posMasks = np.array([entries[word][0] for word in words], dtype=np.uint16).reshape(len(words))
+    syllables = np.array([min(entries[word][1], 255) for word in words], dtype=np.uint8).reshape(len(words))
+    order = np.array([entries[word][2] for word in words], dtype=np.uint32).reshape(len(words))
+    #open addressing: a word goes in the first empty slot from its hash on
+    numSlots = 1
+    while numSlots < 2 * len(words):
+        numSlots *= 2
+    slots = [-1] * numSlots
+    for i, word in enumerate(words):
+        slot = getHash(word) & (numSlots - 1)
+        while slots[slot] >= 0:
+            slot = (slot + 1) & (numSlots - 1)
+        slots[slot] = i
+    arrays = [("slots", np.array(slots, dtype=np.int32)), ("offsets", offsets),
+              ("posMasks", posMasks), ("syllables", syllables), ("order", order),
+              ("words", np.frombuffer("".join(words) or "\0", dtype=np.uint8))]
+
+    #laid out like DataTable.save, so the arrays can be mapped straight from the file
+    schema = {"numWords": len(words), "numSlots": numSlots,
+              "contentHash": getEntriesHash(words, posMasks, syllables)}
+    position = 1 << 12
+    for name, array in arrays:
+        schema[name] = {"dtype": array.dtype.str, "size": len(array), "start": position}
+        position = (position + array.nbytes + 63) // 64 * 64
+    header = LEXICON_MAGIC + json.dumps(schema) + "\n"
+
+    #write to a temporary file first so nobody ever maps half a lexicon
+    tempFile = fileName + ".%d.tmp" % os.getpid()
+    lexiconFile = open(tempFile, "wb")
+    lexiconFile.write(header)
+    for name, array in arrays:
+        lexiconFile.seek(schema[name]["start"])
+        lexiconFile.write(array.tobytes())
+    lexiconFile.truncate(position)
+    lexiconFile.close()
+    os.rename(tempFile, fileName)
+
+def isLexiconFile(fileName):
+    '''
+    Checks whether fileName is a lexicon written by compileLexicon.
+    '''
+    lexiconFile = open(fileName, "rb")
+    start = lexiconFile.read(len(LEXICON_MAGIC))
+    lexiconFile.close()
+    return start == LEXICON_MAGIC
+
+def openLexicon(wordDictFile="wordDict.txt", posFile=None, fileName=None):
+    '''
+    Returns the compiled Lexicon for wordDictFile (plus posFile, if given).
+    It is kept next to wordDictFile (wordDict.lex, or wordDict+mobypos.lex with
+    mobypos.txt) unless fileName says where, and compiled again if it is
+    missing, older than the files it was made from, or in an older format.
+    If wordDictFile is already a compiled lexicon, it is just opened.
+    '''
+    if isLexiconFile(wordDictFile):
+        return Lexicon(wordDictFile)
+    sources = [wordDictFile]
+    if fileName is None:
+        fileName = os.path.splitext(wordDictFile)[0]
+        if posFile is not None:
+            fileName += "+" + os.path.splitext(os.path.basename(posFile))[0]
+        fileName += LEXICON_EXTENSION
+    if posFile is not None:
+        sources.append(posFile)
+    if not os.path.exists(fileName) or not isLexiconFile(fileName) or \
+       os.path.getmtime(fileName) < max(os.path.getmtime(source) for source in sources):
+        compileLexicon(fileName, wordDictFile, posFile)
+    return Lexicon(fileName)
+
+class Lexicon(object):
+    '''
+    A compiled lexicon, opened read only. It works like the dictionary that
+    makeHaikuTable.makeDictionary makes, {word: (pos, syllables)}, so it can be
+    handed to anything that takes one; the part of speech strings list the
+    letters in the order of POS_CODES.
+    posMasks and syllables are arrays over the words in sorted order, for
+    looking at many words at once (see find for turning a word into an index);
+    order says where each word was in the files the lexicon was compiled from.
+    contentHash is the getEntriesHash of the words.
+
+    Pickling a Lexicon only sends its file name, so worker processes that are
+    given one open the file themselves and share its pages.
+    '''
+    def __init__(self, fileName):
+        self.open(fileName)
+
+    def open(self, fileName):
+        self.fileName = fileName
+        lexiconFile = open(fileName, "rb")
+        if lexiconFile.readline() != LEXICON_MAGIC:
+            lexiconFile.close()
+            raise ValueError(fileName + " is not a compiled lexicon")
+        schema = json.loads(lexiconFile.readline())
+        self.data = mmap.mmap(lexiconFile.fileno(), 0, access=mmap.ACCESS_READ)
+        lexiconFile.close() #the map stays open without the file
+        self.numWords = schema["numWords"]
+        self.slotMask = schema["numSlots"] - 1
+        self.contentHash = str(schema["contentHash"])
+        for name in ["slots", "offsets", "posMasks", "syllables", "order", "words"]:
+            info = schema[name]
+            setattr(self, name, np.frombuffer(self.data, info["dtype"], info["size"], info["start"]))
+        #where the arrays find uses start, for reading them with struct
+        self.slotsStart = schema["slots"]["start"]
+        self.offsetsStart = schema["offsets"]["start"]
+        self.wordsStart = schema["words"]["start"]
+
+    def __getstate__(self):
+        return {"fileName": self.fileName}
+
+    def __setstate__(self, state):
+        self.open(state["fileName"])
+
+    def find(self, word):
+        '''
+        Returns the index of word, or -1 if it is not in the lexicon.
+        '''
+        data = self.data
+        slot = getHash(word) & self.slotMask
+        while True:
+            index = struct.unpack_from("<i", data, self.slotsStart + 4 * slot)[0]
+            if index < 0:
+                return -1
+            start, end = struct.unpack_from("<II", data, self.offsetsStart + 4 * index)
+            if end - start == len(word) and data[self.wordsStart + start:self.wordsStart + end] == word:
+                return index
+            slot = (slot + 1) & self.slotMask
+
+    def getWord(self, index):
+        start, end = struct.unpack_from("<II", self.data, self.offsetsStart + 4 * index)
+        return self.data[self.wordsStart + start:self.wordsStart + end]
+
+    def getEntry(self, index):
+        return getPOSString(int(self.posMasks[index])), int(self.syllables[index])
+
+    def hasPOS(self, part):
+        '''
+        Returns a boolean array over the words saying which can be the part of speech part.
+        '''
+        return (self.posMasks & (1 << POS_CODES.index(part))) != 0
+
+    def __len__(self):
+        return self.numWords
+
+    def __contains__(self, word):
+        return self.find(word) >= 0
+
+    def __getitem__(self, word):
+        index = self.find(word)
+        if index < 0:
+            raise KeyError(word)
+        return self.getEntry(index)
+
+    def get(self, word, default=None):
+        index = self.find(word)
+        if index < 0:
+            return default
+        return self.getEntry(index)
+
+    def __iter__(self):
+        for index in xrange(self.numWords):
+            yield self.getWord(index)
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return [(self.getWord(index), self.getEntry(index)) for index in xrange(self.numWords)]
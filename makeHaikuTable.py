@@ -2,6 +2,12 @@
 This will generate a table file for unclassified haiku
 please add whatever interesting stuff you want!
 '''
+import os, zlib, shutil, hashlib, itertools, multiprocessing
+import numpy as np
+from dataTable import DataTable, saveUnratedTable
+from workerPool import runTasks
+from lexicon import Lexicon, openLexicon, isLexiconFile, writeLexicon, getEntries, getLexiconHash, \
+                    getPOSMask, getPOSString, POS_CODES, LEXICON_EXTENSION
 
 def parseHaiku(fileName):
 	'''
@@ -10,24 +16,79 @@ def parseHaiku(fileName):
 	'''
 	haikuFile = open(fileName)
 	haikuDict = {}
+	for ID, haiku in iterHaiku(haikuFile):
+		assert ID not in haikuDict
+		haikuDict[ID] = haiku
+	haikuFile.close()
+	return haikuDict
+
+def iterHaiku(lines):
+	'''
+	Goes through the lines of a haikuDB file (an open file, or a list of lines)
+	yielding (ID, haiku) in the order they come in.
+	'''
+	ID = None
 	haiku = ""
-	curId = 0
-	for line in haikuFile:
+	for line in lines:
 		line = line.strip()
+		if not line:
+			continue
 		if not line[0].isalpha():
 			#we're at the first line of the haiku
+			if ID is not None:
+				yield ID, haiku
 			line = line.split("\t")
 			ID = int(line[0])
-			curId = ID
 			haiku = line[1]
-			assert ID not in haikuDict
-			haikuDict[ID] = haiku
 		else:
 			haiku += "\n" + line
-			haikuDict[curId] = haiku
-	return haikuDict
+	if ID is not None:
+		yield ID, haiku
+
+def iterBlocks(fileName, blockSize=1 << 22):
+	'''
+	Reads a haikuDB file in pieces of about blockSize bytes, each cut just
+	before the first line of a haiku, so every piece holds whole haikus.
+	'''
+	dbFile = open(fileName)
+	leftOver = ""
+	while True:
+		data = dbFile.read(blockSize)
+		if not data:
+			break
+		data = leftOver + data
+		cut = findLastHaiku(data)
+		leftOver = data[cut:]
+		if cut > 0:
+			yield data[:cut]
+	dbFile.close()
+	if leftOver:
+		yield leftOver
+
+def findLastHaiku(data):
+	'''
+	Where the first line of the last haiku that starts in data begins (0 if none does).
+	A haiku starts on a line that does not start with a letter, like in iterHaiku.
+	'''
+	position = len(data)
+	while position > 0:
+		position = data.rfind("\n", 0, position)
+		end = data.find("\n", position + 1)
+		if end < 0:
+			end = len(data)
+		line = data[position + 1:end].strip()
+		if line and not line[0].isalpha():
+			return position + 1
+	return 0
 
 def makeDictionary(dictFilename):
+	'''
+	Reads wordDict.txt into a dictionary {word: (pos, syllables)}.
+	Given a compiled lexicon instead (see lexicon.py), it opens that, which
+	takes no time; openLexicon makes one from wordDict.txt.
+	'''
+	if isLexiconFile(dictFilename):
+		return Lexicon(dictFilename)
 	wordFile = open(dictFilename)
 	dictionaryDict = {}
 	for line in wordFile:
@@ -66,34 +127,389 @@ def getAvgWordLength(haiku):
 	avg = int(round(float(wordLengths/len(haiku))))
 	return avg
 
-def makeTableFile(haikuDict, dictionaryDict):
-	tableFile = open("haikuTableWhole.txt", "w")
-	line1 = "nouns \t verbs \t adjectives \t av. syllables \t av. word length"
-	print >>tableFile, line1
-	for ID in haikuDict:
-		haiku = haikuDict[ID]
-		numNouns = str(getNumPOS(haiku, "N", dictionaryDict))
-		numVerbs = str(getNumPOS(haiku, "V", dictionaryDict))
-		numAdj = str(getNumPOS(haiku, "A", dictionaryDict))
-		numSyll = str(getAvgSyll(haiku, dictionaryDict))
-		wordLen = str(getAvgWordLength(haiku))
-		newLine = numNouns + "\t" + numVerbs + "\t" + numAdj + "\t" + numSyll + "\t" + wordLen
-		print >>tableFile, newLine
+FEATURE_NAMES = ["nouns", "verbs", "adjectives", "avgsyllables", "avgwordlength"]
+TABLE_EXTENSION = ".table" #makeTableFile writes a binary DataTable to files ending in this
+TABLE_HEADER = "nouns \t verbs \t adjectives \t av. syllables \t av. word length" #first line of a text table
+TEXT_NAMES = [name.strip() for name in TABLE_HEADER.split("\t")] #what TABLE_HEADER calls FEATURE_NAMES
+
+class FeatureExtractor:
+	'''
+	Works out the features of many haikus at once.
+	The dictionary is looked through once when this is made: every word gets a
+	row of wordFeatures saying whether it is a noun, verb and adjective (the same
+	"N", "V" and "A" tests getNumPOS does) and how many syllables it has.
+	After that each haiku is split once and each of its words looked up once.
+	A compiled Lexicon is not looked through at all: its words are looked up
+	in the file, so nothing here grows with the size of the lexicon.
+	'''
+	def __init__(self, dictionaryDict):
+		self.lexicon = None
+		self.wordIndex = {}
+		if isinstance(dictionaryDict, Lexicon):
+			self.lexicon = dictionaryDict
+			return
+		#the last row is for words that are not in the dictionary
+		self.wordFeatures = np.zeros((len(dictionaryDict) + 1, 4), dtype=np.int64)
+		for i, word in enumerate(dictionaryDict):
+			pos, syllables = dictionaryDict[word]
+			self.wordIndex[word] = i
+			self.wordFeatures[i] = ["N" in pos, "V" in pos, "A" in pos, syllables]
+
+	def getFeatureMatrix(self, haikus):
+		'''
+		Returns an integer matrix with a row for each haiku (in the order given)
+		and a column for each of FEATURE_NAMES, with the same numbers getHaikuInfo gives.
+		'''
+		#map keeps the loops over words out of the interpreter
+		haikuWords = map(str.split, haikus)
+		numWords = np.fromiter(map(len, haikuWords), np.int64, len(haikus))
+		words = list(itertools.chain.from_iterable(haikuWords))
+		wordFeatures = self.lookUpWords(words)
+		wordLengths = np.fromiter(map(len, words), np.int64, len(words))
+		haikuOf = np.repeat(np.arange(len(haikus)), numWords) #which haiku each word is from
+
+		features = np.zeros((len(haikus), 5), dtype=np.int64)
+		for column in range(4):
+			features[:, column] = np.bincount(haikuOf, wordFeatures[:, column], len(haikus))
+		features[:, 4] = np.bincount(haikuOf, wordLengths, len(haikus))
+		numWords = np.maximum(numWords, 1)
+		#rounded halves up, like round does for these positive numbers
+		features[:, 3] = np.floor(features[:, 3] / numWords.astype(float) + .5)
+		features[:, 4] = features[:, 4] // numWords #getAvgWordLength rounds down
+		return features
+
+	def lookUpWords(self, words):
+		'''
+		Returns a row of (noun, verb, adjective, syllables) for each word,
+		all zeros for words that are not in the dictionary.
+		'''
+		if self.lexicon is None:
+			unknown = len(self.wordFeatures) - 1
+			wordRows = np.fromiter(map(self.wordIndex.get, words, itertools.repeat(unknown, len(words))), np.int64, len(words))
+			return self.wordFeatures[wordRows]
+		#each different word is looked up in the lexicon once; the index of the
+		#words seen so far grows with the words the haikus use, not the lexicon
+		for word in set(words).difference(self.wordIndex):
+			self.wordIndex[word] = self.lexicon.find(word)
+		wordRows = np.fromiter(map(self.wordIndex.__getitem__, words), np.int64, len(words))
+		known = wordRows >= 0
+		wordFeatures = np.zeros((len(words), 4), dtype=np.int64)
+		posMasks = self.lexicon.posMasks[wordRows[known]]
+		for column, part in enumerate("NVA"):
+			wordFeatures[known, column] = (posMasks >> POS_CODES.index(part)) & 1
+		wordFeatures[known, 3] = self.lexicon.syllables[wordRows[known]]
+		return wordFeatures
+
+	def getFeatures(self, haiku):
+		return self.getFeatureMatrix([haiku])[0]
+
+def makeTableFile(haikuDict, dictionaryDict, fileName="haikuTableWhole.txt"):
+	'''
+	Writes the features of every haiku to fileName as tab-separated text,
+	or as a binary table (see dataTable.py) if fileName ends in .table.
+	The binary table has the names the tree uses and every haiku unrated.
+	Either way the haikus are written in order of their IDs.
+	'''
+	IDs = sorted(haikuDict)
+	features = FeatureExtractor(dictionaryDict).getFeatureMatrix([haikuDict[ID] for ID in IDs])
+	writeTableFile(features, fileName)
+
+def writeTableFile(features, fileName):
+	'''
+	Writes a matrix of features (a row per haiku, a column per name in FEATURE_NAMES)
+	to fileName, as text or as a binary table like makeTableFile does.
+	'''
+	if fileName.endswith(TABLE_EXTENSION):
+		table = DataTable()
+		table.setColumns(FEATURE_NAMES, "Outcome", features, np.full(len(features), -1, dtype=np.int8))
+		table.save(fileName)
+		return
+	tableFile = open(fileName, "w")
+	print >>tableFile, TABLE_HEADER
+	tableFile.write(formatRows(features))
 	tableFile.close()
 
+def formatRows(features):
+	'''
+	The lines of a text table for a matrix of features, as one string.
+	'''
+	return "".join(["\t".join(map(str, row)) + "\n" for row in np.asarray(features).tolist()])
+
+featureExtractor = None #the FeatureExtractor of a buildTableFile worker process
+
+def initFeatureWorker(dictionaryDict):
+	global featureExtractor
+	featureExtractor = FeatureExtractor(dictionaryDict)
+
+def extractBlock(block):
+	'''
+	The features of the haikus in a piece of a haikuDB file from iterBlocks.
+	'''
+	haikus = [haiku for ID, haiku in iterHaiku(block.split("\n"))]
+	return featureExtractor.getFeatureMatrix(haikus)
+
+def extractBlockText(block):
+	'''
+	The lines makeTableFile would write for the haikus in the block, as one string,
+	so the formatting happens in the worker processes too.
+	'''
+	features = extractBlock(block)
+	return formatRows(features), len(features)
+
+def buildTableFile(dbFileName, dictionaryDict, fileName="haikuTableWhole.txt", blockSize=1 << 22, numProcesses=None):
+	'''
+	Does what makeTableFile does straight from a haikuDB file, for databases too
+	big to parse into one dictionary. The file is read in blocks of about
+	blockSize bytes, which are parsed and turned into features by a pool of
+	worker processes, each of which gets its own copy of the dictionary once,
+	when it starts. Only a few blocks per worker are ever waiting, so memory
+	does not grow with the size of the database.
+	The rows are written in the order of the file, as tab-separated text or as a
+	binary table if fileName ends in .table (see makeTableFile).
+	numProcesses is passed on to workerPool.runTasks.
+	Returns the number of haikus.
+	'''
+	if numProcesses is None:
+		numProcesses = multiprocessing.cpu_count()
+	binary = fileName.endswith(TABLE_EXTENSION)
+	if binary:
+		#the features go to a scratch file until all of them are known
+		outFileName = fileName + ".%d.scratch" % os.getpid()
+		outFile = open(outFileName, "wb")
+	else:
+		outFile = open(fileName, "w")
+		print >>outFile, TABLE_HEADER
+
+	numHaikus = 0
+	blocks = iterBlocks(dbFileName, blockSize)
+	if binary:
+		function = extractBlock
+	else:
+		function = extractBlockText
+	results = runTasks(function, blocks, initFeatureWorker, (dictionaryDict,), numProcesses,
+	                   maxWaiting=2 * numProcesses)
+	try:
+		for result in results:
+			if binary:
+				numHaikus += len(result)
+				outFile.write(result.astype(np.int64).tobytes())
+			else:
+				outFile.write(result[0])
+				numHaikus += result[1]
+	finally:
+		outFile.close()
+		results.close() #stops the pool, if it is still running
+
+	if binary:
+		#read back in blocks, so the whole table is never in memory at once
+		blockRows = 1 << 16
+		def readBlocks():
+			scratchFile = open(outFileName, "rb")
+			for start in range(0, numHaikus, blockRows):
+				count = min(blockRows, numHaikus - start) * len(FEATURE_NAMES)
+				yield np.fromfile(scratchFile, np.int64, count)
+			scratchFile.close()
+		saveUnratedTable(fileName, FEATURE_NAMES, "Outcome", readBlocks)
+		os.remove(outFileName)
+	return numHaikus
+
+CACHE_EXTENSION = ".cache.npz"
+
+def updateTableFile(dbFileName, dictionaryDict, fileName="haikuTableWhole.txt", cacheFileName=None):
+	'''
+	Does what makeTableFile does for a haikuDB file, but keeps the features of
+	every haiku in a cache file (fileName + .cache.npz by default), keyed by a
+	hash of the haiku's text, so that the next time only new or changed haikus
+	have their features worked out.
+
+	The cache also remembers a hash of the dictionary it was made with, and
+	keeps a copy of that dictionary (as a compiled lexicon, next to the cache).
+	Only if the hash has changed are the two compared word by word, and exactly
+	the cached haikus that use an added, removed or changed word are worked out
+	again. A plain dictionary and a compiled Lexicon of the same words count as
+	the same dictionary.
+	And it remembers how much of the database it has seen: if the database only
+	had haikus added to the end (and the dictionary is the same), the old part is
+	not even parsed, and a text table written last time just gets the new rows
+	added to its end, so adding a few haikus to a big database is quick.
+	Returns the number of haikus whose features had to be worked out.
+	'''
+	if cacheFileName is None:
+		cacheFileName = fileName + CACHE_EXTENSION
+	snapshotFileName = cacheFileName + LEXICON_EXTENSION
+	lexiconHash = getLexiconHash(dictionaryDict)
+	cache = loadFeatureCache(cacheFileName)
+	changedWords = set()
+	if lexiconHash != cache["lexiconHash"]:
+		changedWords = findChangedWords(dictionaryDict, snapshotFileName, cache["lexiconHash"])
+	dbSize = os.path.getsize(dbFileName)
+
+	dbFile = open(dbFileName)
+	appended = False
+	checksum = None
+	if lexiconHash == cache["lexiconHash"] and dbSize >= cache["dbSize"]:
+		checksum = checksumFile(dbFile, cache["dbSize"])
+	if checksum == cache["dbChecksum"] and startsHaiku(dbFile, cache["dbSize"]):
+		#only the haikus after what the cache has seen are new
+		appended = True
+		dbFile.seek(cache["dbSize"])
+		newHaikus = [haiku for ID, haiku in iterHaiku(dbFile)]
+		newKeys = np.array(map(getHaikuKey, newHaikus), dtype=np.uint64).reshape(len(newHaikus))
+		newFeatures = FeatureExtractor(dictionaryDict).getFeatureMatrix(newHaikus)
+		keys = np.concatenate([cache["keys"], newKeys])
+		features = np.concatenate([cache["features"], newFeatures])
+		numWorkedOut = len(newHaikus)
+		dbFile.seek(cache["dbSize"])
+		checksum = checksumFile(dbFile, dbSize - cache["dbSize"], checksum)
+	else:
+		dbFile.seek(0)
+		haikus = [haiku for ID, haiku in iterHaiku(dbFile)]
+		keys = np.array(map(getHaikuKey, haikus), dtype=np.uint64).reshape(len(haikus))
+		cachedRows = dict(zip(cache["keys"].tolist(), range(len(cache["keys"]))))
+		features = np.zeros((len(haikus), len(FEATURE_NAMES)), dtype=np.int64)
+		missing = []
+		for i, key in enumerate(keys.tolist()):
+			row = cachedRows.get(key)
+			if row is None or changedWords is None or \
+			   (changedWords and not changedWords.isdisjoint(haikus[i].split())):
+				missing.append(i)
+			else:
+				features[i] = cache["features"][row]
+		features[missing] = FeatureExtractor(dictionaryDict).getFeatureMatrix([haikus[i] for i in missing])
+		numWorkedOut = len(missing)
+		dbFile.seek(0)
+		checksum = checksumFile(dbFile, dbSize)
+	dbFile.close()
+
+	if appended and not fileName.endswith(TABLE_EXTENSION) and os.path.exists(fileName) \
+	   and os.path.getsize(fileName) == cache["tableSize"]:
+		#the text table is still the one written last time, so the new rows just go on the end
+		tableFile = open(fileName, "a")
+		tableFile.write(formatRows(newFeatures))
+		tableFile.close()
+	else:
+		writeTableFile(features, fileName)
+	if lexiconHash != cache["lexiconHash"]:
+		#the copy goes first: a cache whose hash does not match its copy is just not trusted
+		saveLexiconSnapshot(dictionaryDict, snapshotFileName)
+	saveFeatureCache(cacheFileName, {"keys": keys, "features": features, "lexiconHash": lexiconHash,
+	                                 "dbSize": dbSize, "dbChecksum": checksum,
+	                                 "tableSize": os.path.getsize(fileName)})
+	return numWorkedOut
+
+def getHaikuKey(haiku):
+	'''
+	What the feature cache files a haiku under: the first 64 bits of the sha1 of its text.
+	'''
+	return int(hashlib.sha1(haiku).hexdigest()[:16], 16)
+
+def loadFeatureCache(cacheFileName):
+	'''
+	Reads a cache written by saveFeatureCache, or returns an empty one
+	if there is no cache file yet.
+	'''
+	if not os.path.exists(cacheFileName):
+		return {"keys": np.zeros(0, dtype=np.uint64), "features": np.zeros((0, len(FEATURE_NAMES)), dtype=np.int64),
+		        "lexiconHash": None, "dbSize": 0, "dbChecksum": checksumFile(None, 0), "tableSize": -1}
+	saved = np.load(cacheFileName)
+	return {"keys": saved["keys"], "features": saved["features"],
+	        "lexiconHash": str(saved["lexiconHash"]) if "lexiconHash" in saved.files else None,
+	        "dbSize": int(saved["dbSize"]), "dbChecksum": int(saved["dbChecksum"]),
+	        "tableSize": int(saved["tableSize"])}
+
+def saveFeatureCache(cacheFileName, cache):
+	#write to a temporary file first so a half written cache is never read
+	tempFile = cacheFileName + ".%d.tmp" % os.getpid()
+	cacheFile = open(tempFile, "wb")
+	np.savez(cacheFile, keys=cache["keys"], features=cache["features"], lexiconHash=cache["lexiconHash"],
+	         dbSize=cache["dbSize"], dbChecksum=cache["dbChecksum"], tableSize=cache["tableSize"])
+	cacheFile.close()
+	os.rename(tempFile, cacheFileName)
+
+def saveLexiconSnapshot(dictionaryDict, fileName):
+	'''
+	Keeps a copy of the dictionary a feature cache was made with, as a compiled lexicon.
+	'''
+	if isinstance(dictionaryDict, Lexicon):
+		tempFile = fileName + ".%d.tmp" % os.getpid()
+		shutil.copyfile(dictionaryDict.fileName, tempFile)
+		os.rename(tempFile, fileName)
+	else:
+		writeLexicon(fileName, getEntries(dictionaryDict))
+
+def findChangedWords(dictionaryDict, snapshotFileName, lexiconHash):
+	'''
+	Returns the set of words whose entries differ between dictionaryDict and
+	the copy saved by saveLexiconSnapshot, or None if there is no copy with
+	the hash lexiconHash, in which case every word has to count as changed.
+	'''
+	if not os.path.exists(snapshotFileName) or not isLexiconFile(snapshotFileName):
+		return None
+	snapshot = Lexicon(snapshotFileName)
+	if snapshot.contentHash != lexiconHash:
+		return None
+	old = dict(snapshot.items())
+	#the parts of speech in the order a Lexicon gives them
+	new = dict((word, (getPOSString(getPOSMask(pos)), syllables)) for word, (pos, syllables) in dictionaryDict.items())
+	return set(word for word in set(old) | set(new) if old.get(word) != new.get(word))
+
+def checksumFile(openFile, size, checksum=0):
+	'''
+	Carries on the crc32 checksum over the next size bytes of an open file.
+	It is only there to notice edits, so it does not need to be a strong hash,
+	just a fast one.
+	'''
+	while size > 0:
+		data = openFile.read(min(size, 1 << 20))
+		if not data:
+			break
+		checksum = zlib.crc32(data, checksum)
+		size -= len(data)
+	return checksum & 0xffffffff
+
+def startsHaiku(dbFile, position):
+	'''
+	Checks that what comes after position in the database starts a new haiku
+	(or is nothing), rather than adding lines to the haiku before it.
+	If the line before position had not ended, anything after it is more of that line.
+	'''
+	if position > 0:
+		dbFile.seek(position - 1)
+		if dbFile.read(1) != "\n":
+			return dbFile.read(1) == ""
+	for line in dbFile:
+		line = line.strip()
+		if line:
+			return not line[0].isalpha()
+	return True
+
 def getHaikuInfo(haiku, dictionaryDict):
-	numNouns = getNumPOS(haiku, "N", dictionaryDict)
-	numVerbs = getNumPOS(haiku, "V", dictionaryDict)
-	numAdj = getNumPOS(haiku, "A", dictionaryDict)
-	numSyll = getAvgSyll(haiku, dictionaryDict)
-	wordLen = getAvgWordLength(haiku)
+	'''
+	Works out all the features of one haiku in one go over its words
+	(for many haikus, FeatureExtractor is faster).
+	'''
+	words = haiku.split()
+	numNouns = 0
+	numVerbs = 0
+	numAdj = 0
+	totalSyll = 0
+	totalLength = 0
+	for word in words:
+		totalLength += len(word)
+		if word in dictionaryDict:
+			pos, syllables = dictionaryDict[word]
+			numNouns += "N" in pos
+			numVerbs += "V" in pos
+			numAdj += "A" in pos
+			totalSyll += syllables
+	numSyll = int(round(totalSyll/float(len(words))))
+	wordLen = totalLength // len(words)
 	haikuInfo = {"nouns":numNouns, "verbs":numVerbs, "adjectives":numAdj, "avgwordlength":wordLen, "avgsyllables":numSyll}
 	return haikuInfo
 
 def main():
-	haikuDict = parseHaiku("testhaikuDB")
-	wordDict = makeDictionary("wordDict.txt")
-	makeTableFile(haikuDict, wordDict)
+	wordDict = openLexicon("wordDict.txt")
+	buildTableFile("testhaikuDB", wordDict)
 
 if __name__=="__main__":
 	main()
\ No newline at end of file
@@ -4,8 +4,10 @@ Holly French and Alexandra Price
 This file contains the class for the decisionTree, 
 as well as a class for the nodes that comprise it.
 '''
-from scipy import stats
 import math, heapq
+from collections import deque
+import numpy as np
+from dataTable import DataTable
 class DecisionTree:
     '''
     This class is essentially there in order to keep track
@@ -13,112 +15,216 @@ class DecisionTree:
     '''
     def __init__(self):
         self.root = None
+        self.leaves = None #made by indexLeaves the first time it is needed
+        self.leafParents = None
+        self.compiled = None #made by getCompiled, thrown away when the tree changes
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["compiled"] = None #it finds nodes by id, which a copy doesn't keep
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        #trees pickled before there was a leaf index or a compiled copy
+        for name in ["leaves", "leafParents", "compiled"]:
+            self.__dict__.setdefault(name, None)
 
     def getRoot(self):
         return self.root
     
     def setRoot(self, root):
         self.root = root
+        self.leaves = None
+        self.leafParents = None
+        self.compiled = None
+
+    def breadthFirst(self):
+        '''
+        Goes through the nodes layer by layer, yielding (node, depth)
+        with the root at depth 0.
+        '''
+        nodeQueue = deque([(self.root, 0)])
+        while nodeQueue:
+            tempNode, depth = nodeQueue.popleft()
+            yield tempNode, depth
+            for child in tempNode.getChildren():
+                nodeQueue.append((child, depth + 1))
+
+    def depthFirst(self):
+        '''
+        Yields (node, depth) for every node before any of its children,
+        going down the first child before the second.
+        '''
+        nodeStack = [(self.root, 0)]
+        while nodeStack:
+            tempNode, depth = nodeStack.pop()
+            yield tempNode, depth
+            for child in reversed(tempNode.getChildren()):
+                nodeStack.append((child, depth + 1))
+
+    def postOrder(self):
+        '''
+        Yields (node, depth) for every node after all of its children.
+        A node's children can be pruned when it comes up, since they are done.
+        '''
+        nodeStack = [(self.root, 0, False)]
+        while nodeStack:
+            tempNode, depth, childrenDone = nodeStack.pop()
+            children = tempNode.getChildren()
+            if childrenDone or children == []:
+                yield tempNode, depth
+                continue
+            nodeStack.append((tempNode, depth, True))
+            for child in reversed(children):
+                nodeStack.append((child, depth + 1, False))
+
+    def indexLeaves(self):
+        '''
+        Finds the leaves (nodes without children) and the leaf parents
+        (nodes whose children are all leaves). After this, Node.addChild and
+        Node.pruneChildren keep both up to date, so they are never searched for again.
+        '''
+        self.leaves = set()
+        self.leafParents = set()
+        for tempNode, depth in self.breadthFirst():
+            tempNode.tree = self
+            self.addToIndex(tempNode)
+
+    def addToIndex(self, node):
+        children = node.getChildren()
+        if children == []:
+            self.leaves.add(node)
+        elif all(child.getChildren() == [] for child in children):
+            self.leafParents.add(node)
+
+    def childAdded(self, parent, child):
+        '''
+        Called by Node.addChild once the index exists.
+        '''
+        self.compiled = None
+        self.leaves.discard(parent)
+        grandparent = parent.getParent()
+        if grandparent is not None:
+            self.leafParents.discard(grandparent) #parent is not a leaf anymore
+        for tempNode in subtree(child):
+            tempNode.tree = self
+            self.addToIndex(tempNode)
+        self.leafParents.discard(parent)
+        self.addToIndex(parent)
+
+    def childrenPruned(self, node, oldChildren):
+        '''
+        Called by Node.pruneChildren once the index exists.
+        '''
+        self.compiled = None
+        for child in oldChildren:
+            for tempNode in subtree(child):
+                tempNode.tree = None
+                self.leaves.discard(tempNode)
+                self.leafParents.discard(tempNode)
+        self.leafParents.discard(node)
+        self.leaves.add(node)
+        parent = node.getParent()
+        if parent is not None:
+            self.addToIndex(parent)
 
     def getLeafNodes(self):
-        nodeQueue = []
-        nodeQueue.append(self.root)
-        numCurLevel = 1
-        numNextLevel = 0
-        leaves = []
-        while nodeQueue != []:
-            tempNode = nodeQueue[0]
-            numCurLevel -=1
-            nodeQueue = nodeQueue[1:]
-            if tempNode.getOutcome() == "yes" or tempNode.getOutcome() == "no":
-                leaves.append(tempNode)
-            tempNodeChildren = tempNode.getChildren()
-            nodeQueue.extend(tempNodeChildren)
-            numNextLevel +=len(tempNodeChildren)
-            if numCurLevel == 0:
-                numCurLevel = numNextLevel
-                numNextLevel = 0
-        return leaves
+        if self.leaves is None:
+            self.indexLeaves()
+        return list(self.leaves)
 
+    def getLeafParents(self):
+        '''
+        Returns the nodes whose children are all leaves.
+        '''
+        if self.leaves is None:
+            self.indexLeaves()
+        return list(self.leafParents)
 
     def printTree(self):
         '''
         Prints the the tree out layer by layer, using BFS.
         mostly used for debugging.
         '''
-        nodeQueue = []
-        nodeQueue.append(self.root)
-        numCurLevel = 1
-        numNextLevel = 0
-        while nodeQueue != []:
-            tempNode = nodeQueue[0]
-            numCurLevel -=1
-            nodeQueue = nodeQueue[1:]
-            print tempNode.getName(), tempNode.getValue(), tempNode.getOutcome(), '\t',
-            tempNodeChildren = tempNode.getChildren()
-            nodeQueue.extend(tempNodeChildren)
-            numNextLevel +=len(tempNodeChildren)
-            if numCurLevel == 0:
+        curDepth = 0
+        for tempNode, depth in self.breadthFirst():
+            if depth != curDepth:
                 print
-                numCurLevel = numNextLevel
-                numNextLevel = 0
+                curDepth = depth
+            print tempNode.getName(), tempNode.getValue(), tempNode.getOutcome(), '\t',
+        print
 
     def contract(self):
-        leaves = self.getLeafNodes()
-        contracted = False
-        while not contracted:
-            contracted = True
-            leafParents = []
-            for leaf in leaves:
-                parent = leaf.getParent()
-                if parent not in leafParents:
-                    leafParents.append(parent)
-            for node in leafParents:
-                children = node.getChildren()
-                if len(children) == 2 and children[0].getOutcome() == children[1].getOutcome():
-                    node.setName("Outcome")
-                    node.setOutcome(children[0].getOutcome())
-                    node.pruneChildren()
-                    contracted = False
-
-    def makeGraphViz(self, accuracy):
-        '''
-        Writes to a graphViz file, tree.dot
-        In order to view the tree,
+        '''
+        Turns every node that splits into two leaves with the same outcome into
+        a leaf with that outcome, which may in turn let its parent be contracted.
+        Nothing gets classified differently.
+        '''
+        nodeStack = self.getLeafParents()
+        while nodeStack:
+            node = nodeStack.pop()
+            if node not in self.leafParents:
+                continue
+            children = node.getChildren()
+            if len(children) == 2 and children[0].getOutcome() == children[1].getOutcome():
+                node.setName("Outcome")
+                node.setOutcome(children[0].getOutcome())
+                node.pruneChildren()
+                if node.getParent() in self.leafParents:
+                    nodeStack.append(node.getParent())
+
+    def makeGraphViz(self, accuracy=None, dotFile="tree.dot", maxDepth=None, maxNodes=None):
+        '''
+        Writes the tree in graphViz's dot format to dotFile, which can be a file name
+        or anything with a write method (an open file, sys.stdout, the stdin of a dot process).
+        In order to view the tree from tree.dot,
         run the following in the terminal:
         dot -Tpdf tree.dot -o tree.pdf
         This will create a pdf containing the tree,
-        along with a label of its accuracy.
+        along with a label of its accuracy if one is given.
+
+        Every node shows how many yes and no items reached it.
+        The nodes are written one at a time as the tree is read breadth first,
+        so big trees take time and memory in proportion to their size.
+        To keep big trees readable, nothing deeper than maxDepth (the root is depth 0)
+        and no more than maxNodes nodes are drawn; nodes whose children were
+        cut off are drawn dashed.
+        Returns the number of nodes written.
         '''
-        s = "digraph G {"
-        nodeQueue = []
-        nodeQueue.append(self.root)
-        while nodeQueue != []: #this is basically BFS
-            tempNode = nodeQueue[0]
+        if hasattr(dotFile, "write"):
+            outFile = dotFile
+        else:
+            outFile = open(dotFile, "w")
+        outFile.write("digraph G {\n")
+        nodeQueue = deque([(self.root, 0, 0)]) #node, its id in the dot file, depth
+        numNodes = 1
+        while nodeQueue:
+            tempNode, nodeId, depth = nodeQueue.popleft()
+            children = tempNode.getChildren()
+            expand = children != [] and (maxDepth is None or depth < maxDepth) and \
+                     (maxNodes is None or numNodes + len(children) <= maxNodes)
             if tempNode.getOutcome():
-                tempLabel = str(tempNode)+' [label="'+ tempNode.getOutcome() + '"]; '
+                label = tempNode.getOutcome()
             else:
-                tempLabel = str(tempNode)+' [label="'+ tempNode.getName() + '"]; '
-            s+=tempLabel
-            nodeQueue = nodeQueue[1:]
-            for child in tempNode.getChildren():
-                edgeName = '[label="'+str(child.getValue())+'"]'
-                if child.getName() == "Outcome":
-                    label  = str(child)+' [label="'+ child.getOutcome() + '"]; '
-                    s+=label
-                    s+= str(tempNode) + " -> " + str(child) + edgeName+"; "
-                else:
-                    label  = str(child)+' [label="'+ child.getName() + '"]; '
-                    s+=label
-                    s+= str(tempNode) + " -> " + str(child) + edgeName+ "; "
-
-            tempNodeChildren = tempNode.getChildren()
-            nodeQueue.extend(tempNodeChildren)
-        s+='accuracy [penwidth="0",label="Accuracy is '+str(round(accuracy, 3))+'"];'
-        s+="}"
-        dotFile = open("tree.dot", "w")
-        dotFile.write(s)
-        dotFile.close()
+                label = str(tempNode.getName())
+            label += "\\n%d yes / %d no" % (tempNode.getNumYes(), tempNode.getNumNo())
+            style = ""
+            if children != [] and not expand:
+                style = ', style="dashed"'
+            outFile.write('n%d [label="%s"%s];\n' % (nodeId, label.replace('"', '\\"'), style))
+            if not expand:
+                continue
+            for child in children:
+                outFile.write('n%d -> n%d [label="%s"];\n' % (nodeId, numNodes, child.getValue()))
+                nodeQueue.append((child, numNodes, depth + 1))
+                numNodes += 1
+        if accuracy is not None:
+            outFile.write('accuracy [penwidth="0",label="Accuracy is %s"];\n' % round(accuracy, 3))
+        outFile.write("}\n")
+        if outFile is not dotFile:
+            outFile.close()
+        return numNodes
 
     def search(self, itemDict):
         '''
@@ -153,7 +259,7 @@ class DecisionTree:
 
                         if int(curValue) <= int(val):
                             curNode = child
-                            childFound = True
+                            childfound = True
                             break
 
             if not childfound:
@@ -161,95 +267,358 @@ class DecisionTree:
 
             return curNode.getOutcome()
 
+    def compile(self, names):
+        '''
+        Flattens the tree into a CompiledTree, which keeps every node in
+        parallel arrays so that whole matrices of items can be classified at once.
+        names is the list of attributes, in the order of the columns of the
+        matrices that will be passed to CompiledTree.predictBatch.
+        The edge labels are only parsed here, once per node.
+        '''
+        return CompiledTree(self, names)
+
+    def getAttributeNames(self):
+        '''
+        Returns the sorted names of the attributes the tree splits on.
+        '''
+        return sorted(set(tempNode.getName() for tempNode, depth in self.breadthFirst()
+                          if tempNode.getChildren() != []))
+
+    def getCompiled(self):
+        '''
+        Returns the tree compiled over the attributes it splits on (see getAttributeNames).
+        It is compiled the first time and kept until Node.addChild or Node.pruneChildren
+        changes the tree, which the leaf index is there to notice.
+        '''
+        if self.compiled is None:
+            if self.leaves is None:
+                self.indexLeaves()
+            self.compiled = self.compile(self.getAttributeNames())
+        return self.compiled
+
     def createConfidenceHeap(self, haikuDict):
         '''
-        Prints the the tree out layer by layer, using BFS.
-        mostly used for debugging.
+        Gives every node its confidence interval, and returns a heap of
+        [bound, node] with one entry per node.
+        haikuDict is the parsed table (header first, outcome last).
+        The intervals of all the nodes come from a single pass over the rows,
+        see CompiledTree.confidenceIntervals.
         '''
+        table = DataTable(haikuDict)
+        compiledTree = self.compile(table.names)
+        lowerBounds, upperBounds = compiledTree.confidenceIntervals(table.getFeatures(), table.labels)
 
         confidenceHeap = []
-        nodeQueue = []
-        nodeQueue.append(self.root)
-        numCurLevel = 1
-        numNextLevel = 0
-        while nodeQueue != []:
-            tempNode = nodeQueue[0]
-
-            tempNode.setConfidence(haikuDict, self)
+        for i, tempNode in enumerate(compiledTree.nodes):
+            tempNode.setConfidenceInterval(lowerBounds[i], upperBounds[i])
             upper, lower = tempNode.getConfidence()
-
             heapq.heappush(confidenceHeap, [lower, tempNode])
-
-            numCurLevel -=1
-            nodeQueue = nodeQueue[1:]
-            print tempNode.getName(), tempNode.getValue(), tempNode.getOutcome(), '\t',
-            tempNodeChildren = tempNode.getChildren()
-            nodeQueue.extend(tempNodeChildren)
-            numNextLevel +=len(tempNodeChildren)
-            if numCurLevel == 0:
-                print
-                numCurLevel = numNextLevel
-                numNextLevel = 0
-
         return confidenceHeap
 
     def isItemInNode(self, itemDict, node):
         '''
-        Searches for an outcome in the decisionTree, given a dictionary of attributes
-        for a specific case in the following form:
+        Checks whether an item, given as a dictionary of attributes
+        in the following form:
         {attr1: value, attr2:value, etc}
-        an example from the tennis dataset would be:
-        {"outlook":"sunny", "temperature":"hot", etc}
+        reaches the given node of the tree.
+        Only the attributes split on above the node are looked up, so other
+        keys (like the outcome) are ignored and may be missing.
 
-        Returns the outcome ("YES" or "NO") of the case if there is a match,
-        otherwise returns None.
+        To check many items against a node, compile the tree once and
+        use CompiledTree.itemsInNode, which checks them all in one go.
         '''
-        curNode = self.root
-        if curNode == node:
-            return True
-        else:
-            while not curNode.getOutcome():
-                curAttribute = curNode.getName()
-                curValue = itemDict[curAttribute]
-                children = curNode.getChildren()
+        compiledTree = self.getCompiled()
+        if id(node) not in compiledTree.nodeIndex:
+            return False #not a node the tree can reach
+        i = compiledTree.getIndex(node)
+        for j, name in enumerate(compiledTree.names):
+            lower = compiledTree.lowerBound[i, j]
+            upper = compiledTree.upperBound[i, j]
+            if lower == np.iinfo(np.int64).min and upper == np.iinfo(np.int64).max:
+                continue #no split above the node uses this attribute
+            if name not in itemDict or not lower < int(itemDict[name]) <= upper:
+                return False
+        return True
 
-                #childfound = False
-                for child in children:
-                    if ">" in child.getValue():
-                        val = child.getValue().split()[-1]
-                        if int(curValue) > int(val):
-                            curNode = child
-                            return True
-                            break
-                    elif "<" in child.getValue():
-                        val = child.getValue().split()[-1]
 
-                        if int(curValue) <= int(val):
-                            curNode = child
-                            return True
-                            break
-                    if curNode == node:
-                        return True
-            return False
 
 
 
 
+class CompiledTree:
+    '''
+    A trained DecisionTree flattened into NumPy arrays, made by DecisionTree.compile.
+    Node 0 is the root. For node i:
+    feature[i] is the column it splits on (-1 for leaves),
+    threshold[i] is the value it splits at (values <= threshold go left),
+    left[i] and right[i] are the indices of its children,
+    outcome[i] is 1 for "YES", 0 for "NO" and -1 if it is not a leaf,
+    numYes[i] and numNo[i] are the training counts that reached it.
+    '''
+    def __init__(self, tree=None, names=None):
+        if tree is None:
+            return #filled in by loadCompiledTree
+        self.names = list(names)
+        nodes = [tree.getRoot()]
+        i = 0
+        while i < len(nodes): #BFS, giving every node its index
+            tempNode = nodes[i]
+            i += 1
+            if not tempNode.getOutcome():
+                nodes.extend(tempNode.getChildren())
+        self.nodes = nodes #the Node each index came from, not saved with the tree
+        index = dict((id(node), i) for i, node in enumerate(nodes))
+        self.nodeIndex = index
+
+        numNodes = len(nodes)
+        self.feature = np.full(numNodes, -1, dtype=np.int32)
+        self.threshold = np.zeros(numNodes, dtype=np.int64)
+        self.left = np.zeros(numNodes, dtype=np.int32)
+        self.right = np.zeros(numNodes, dtype=np.int32)
+        self.outcome = np.full(numNodes, -1, dtype=np.int8)
+        self.numYes = np.array([node.getNumYes() for node in nodes], dtype=np.int64)
+        self.numNo = np.array([node.getNumNo() for node in nodes], dtype=np.int64)
+        self.accuracy = None #filled in by whoever measured it, gets saved with the tree
+        for i, node in enumerate(nodes):
+            if node.getOutcome():
+                self.outcome[i] = 1 if node.getOutcome() == "YES" else 0
+                continue
+            children = node.getChildren()
+            if children == []:
+                continue #no branch to follow, so items that get here have no outcome
+            self.feature[i] = self.names.index(node.getName())
+            for child in children:
+                edgeLabel = child.getValue().split()
+                self.threshold[i] = int(edgeLabel[-1])
+                if edgeLabel[0] == ">":
+                    self.right[i] = index[id(child)]
+                else:
+                    self.left[i] = index[id(child)]
+        self.computeBounds()
+
+    def computeBounds(self):
+        '''
+        Works out the box of attribute values that lead to each node:
+        a row reaches node i exactly when lowerBound[i] < row <= upperBound[i]
+        holds for every column.
+        '''
+        numNodes = self.getNumNodes()
+        self.lowerBound = np.full((numNodes, len(self.names)), np.iinfo(np.int64).min, dtype=np.int64)
+        self.upperBound = np.full((numNodes, len(self.names)), np.iinfo(np.int64).max, dtype=np.int64)
+        for i in range(numNodes): #parents always come before their children
+            column = self.feature[i]
+            if column < 0:
+                continue
+            for child in [self.left[i], self.right[i]]:
+                self.lowerBound[child] = self.lowerBound[i]
+                self.upperBound[child] = self.upperBound[i]
+            self.upperBound[self.left[i], column] = min(self.upperBound[i, column], self.threshold[i])
+            self.lowerBound[self.right[i], column] = max(self.lowerBound[i, column], self.threshold[i])
+
+    def getNumNodes(self):
+        return len(self.feature)
+
+    def getIndex(self, node):
+        '''
+        Returns the index of a Node of the tree this was compiled from.
+        '''
+        return self.nodeIndex[id(node)]
+
+    def itemsInNode(self, features, nodeIndex):
+        '''
+        Checks every row of the 2-D feature matrix against the box of node nodeIndex
+        (see computeBounds) at once. Returns the indices of the rows that reach the node.
+        '''
+        features = np.asarray(features)
+        inNode = (features > self.lowerBound[nodeIndex]) & (features <= self.upperBound[nodeIndex])
+        return np.flatnonzero(inNode.all(axis=1))
+
+    def walk(self, features):
+        '''
+        Sends every row of the 2-D feature matrix down the tree together, one level at a time.
+        For every level, yields (rows, nodes): the indices of the rows still on their way
+        down and the index of the node each of them is at.
+        '''
+        features = np.asarray(features)
+        nodeIndex = np.zeros(len(features), dtype=np.int32)
+        rows = np.arange(len(features))
+        while len(rows) > 0:
+            nodes = nodeIndex[rows]
+            yield rows, nodes
+            splits = self.feature[nodes] >= 0
+            rows = rows[splits]
+            nodes = nodes[splits]
+            values = features[rows, self.feature[nodes]]
+            nodeIndex[rows] = np.where(values <= self.threshold[nodes], self.left[nodes], self.right[nodes])
+
+    def route(self, features):
+        '''
+        Returns the index of the node each row of the 2-D feature matrix ends up in.
+        '''
+        nodeIndex = np.zeros(len(features), dtype=np.int32)
+        for rows, nodes in self.walk(features):
+            nodeIndex[rows] = nodes
+        return nodeIndex
+
+    def confidenceIntervals(self, features, labels):
+        '''
+        Works out the confidence interval of every node (see Node.setConfidence)
+        by sending each rated row down the tree once. labels has 1 for yes,
+        0 for no and -1 for unrated rows, which are left out.
+        Returns two arrays (lowerBound, upperBound), one entry per node.
+        '''
+        return self.confidenceStats(features, labels)[2:]
+
+    def confidenceStats(self, features, labels):
+        '''
+        Same as confidenceIntervals, but returns four arrays with one entry per node:
+        (meanFrequencies, totalOverallAttr, lowerBound, upperBound).
+        This is the one place the interval is worked out; Node.setConfidence uses it too.
+        '''
+        totalPosRating, totalPosRatingSquared, totalOverallAttr = self.attributeSums(features, labels)
+        totalOverallAttr[totalOverallAttr == 0] = 0.0000001
+        meanFrequencies = totalPosRatingSquared / totalOverallAttr
+        meanFrequenciesSquared = (totalPosRating / totalOverallAttr)**2
+        sigma = np.sqrt(np.abs(meanFrequencies - meanFrequenciesSquared))
+        #this is just a formula for 95% confidence interval.  1.96 was taking from a random
+        #stats table in my stats book :p
+        return meanFrequencies, totalOverallAttr, meanFrequencies - 1.96*sigma, meanFrequencies + 1.96*sigma
+
+    def attributeSums(self, features, labels):
+        '''
+        For every node the rated rows that reach it add their value of the node's
+        attribute to running sums (leaves count it as 0).
+        Returns three arrays with one entry per node: the sum over the yes rows,
+        the sum of squares over the yes rows, and the sum over all the rated rows.
+        '''
+        features = np.asarray(features)[labels >= 0]
+        isYes = labels[labels >= 0] == 1
+        numNodes = self.getNumNodes()
+        totalPosRating = np.zeros(numNodes)
+        totalPosRatingSquared = np.zeros(numNodes)
+        totalOverallAttr = np.zeros(numNodes)
+        for rows, nodes in self.walk(features):
+            splits = self.feature[nodes] >= 0
+            numAttribute = np.zeros(len(rows))
+            numAttribute[splits] = features[rows[splits], self.feature[nodes[splits]]]
+            totalOverallAttr += np.bincount(nodes, numAttribute, numNodes)
+            yes = isYes[rows]
+            totalPosRating += np.bincount(nodes[yes], numAttribute[yes], numNodes)
+            totalPosRatingSquared += np.bincount(nodes[yes], numAttribute[yes]**2, numNodes)
+        return totalPosRating, totalPosRatingSquared, totalOverallAttr
+
+    def predictBatch(self, features):
+        '''
+        Classifies every row of a 2-D feature matrix (one column per attribute in names).
+        Returns an array with 1 for "YES", 0 for "NO" and -1 where
+        the tree has no branch for the row, like search returning None.
+        '''
+        return self.outcome[self.route(features)]
+
+    def search(self, itemDict):
+        '''
+        Same as DecisionTree.search: takes {attr1: value, attr2:value, etc}
+        and returns "YES" or "NO", or None if there is no branch for the item.
+        '''
+        features = np.array([[int(itemDict[name]) for name in self.names]])
+        outcome = self.predictBatch(features)[0]
+        if outcome == 1:
+            return "YES"
+        elif outcome == 0:
+            return "NO"
+        return None
+
+    def toDecisionTree(self):
+        '''
+        Rebuilds the Node objects of the tree, for the code that walks them
+        (makeGraphViz, activeLearning and so on).
+        '''
+        nodes = [Node() for i in range(self.getNumNodes())]
+        for i in range(self.getNumNodes()):
+            node = nodes[i]
+            node.setNumYes(int(self.numYes[i]))
+            node.setNumNo(int(self.numNo[i]))
+            node.setNumItems(int(self.numYes[i] + self.numNo[i]))
+            if self.outcome[i] >= 0:
+                node.setName("Outcome")
+                node.setOutcome("YES" if self.outcome[i] == 1 else "NO")
+            elif self.feature[i] >= 0:
+                node.setName(self.names[self.feature[i]])
+                for childIndex, edgeLabel in [(self.left[i], "<= "), (self.right[i], "> ")]:
+                    child = nodes[childIndex]
+                    child.setValue(edgeLabel + str(self.threshold[i]))
+                    child.setParent(node)
+                    node.addChild(child)
+        tree = DecisionTree()
+        tree.setRoot(nodes[0])
+        return tree
+
+    def save(self, fileName):
+        '''
+        Writes the tree to fileName in NumPy's .npz format: the node arrays,
+        the names of the attributes it expects, and the accuracy if it was set.
+        Read it back with loadCompiledTree.
+        '''
+        accuracy = np.nan if self.accuracy is None else self.accuracy
+        modelFile = open(fileName, "wb")
+        np.savez(modelFile, formatVersion=MODEL_FORMAT_VERSION, names=np.array(self.names),
+                 feature=self.feature, threshold=self.threshold, left=self.left, right=self.right,
+                 outcome=self.outcome, numYes=self.numYes, numNo=self.numNo, accuracy=accuracy)
+        modelFile.close()
+
+MODEL_FORMAT_VERSION = 1 #change when the saved arrays change
 
+def loadCompiledTree(fileName):
+    '''
+    Reads a tree written by CompiledTree.save.
+    '''
+    saved = np.load(fileName)
+    if int(saved["formatVersion"]) != MODEL_FORMAT_VERSION:
+        raise ValueError(fileName + " was saved in a different model format")
+    tree = CompiledTree()
+    tree.nodes = None
+    tree.nodeIndex = {}
+    tree.names = [str(name) for name in saved["names"]]
+    for name in ["feature", "threshold", "left", "right", "outcome", "numYes", "numNo"]:
+        setattr(tree, name, saved[name])
+    accuracy = float(saved["accuracy"])
+    tree.accuracy = None if math.isnan(accuracy) else accuracy
+    saved.close()
+    tree.computeBounds()
+    return tree
+
+
+
+def subtree(node):
+    '''
+    Yields node and everything below it.
+    '''
+    nodeStack = [node]
+    while nodeStack:
+        tempNode = nodeStack.pop()
+        yield tempNode
+        nodeStack.extend(tempNode.getChildren())
 
-class Node:
+class Node(object):
     '''
     This class is for the nodes within the decisionTree.
     It contains all the data associated with a node, 
     and its main purpose is to keep track of the parent and 
     child pointers.
+
+    The fields are slots instead of a per-node dictionary, which makes a node
+    several times smaller, so big trees and forests fit in much less memory.
     '''
+    __slots__ = ["outcome", "name", "value", "parent", "children", "tree", "numItems", "numYes", "numNo",
+                 "meanFrequencies", "confidence_interval", "totalOverallAttr"]
+
     def __init__(self):
         self.outcome = None #if the node is a leaf, this will be "YES" or "NO"
         self.name = None #this is the attribute the node is splitting on
         self.value = None #this is the value of the parent attribute this node represents
         self.parent = None
         self.children = []
+        self.tree = None #the DecisionTree whose leaf index this node is in, if any
         self.numItems = 0
         self.numYes = 0
         self.numNo = 0
@@ -263,6 +632,14 @@ class Node:
         #just keeps track of the total number of occurrences of an attr -> easier to calculate confidence with
         self.totalOverallAttr = 0
 
+    def __getstate__(self):
+        #without a __dict__, pickle's default protocol needs to be told what to save
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def setMeanFrequencies(self, haikuDict):
         #this requires our dictionary of whatever values we have for our haikus
         #I'm not sure exactly how this is going to turn out, but I'm guessing this will be a table
@@ -325,55 +702,46 @@ class Node:
 
     def addChild(self, child):
         self.children.append(child)
+        if self.tree is not None:
+            self.tree.childAdded(self, child)
 
     def getChildren(self):
         return self.children
 
     def pruneChildren(self):
+        oldChildren = self.children
         self.children = []
+        if self.tree is not None:
+            self.tree.childrenPruned(self, oldChildren)
 
     def getValue(self):
         return self.value
 
     def setValue(self, value):
+        if isinstance(value, str):
+            value = intern(value) #every node splitting at the same place shares one label
         self.value = value
 
     def setConfidence(self, haikuDict, tree):
         #very similar to the mean stuff.  maybe I could consolidate this into one function
         #but for the time being i'll keep it separate just for debugging
-        totalPosRating = 0
-        totalPosRatingSquared = 0
-        numAttribute = 0
-        for entry in haikuDict:
-            if entry[-1] == "yes" or entry[-1] == "no":
-                entryDict = {}
-                for i in range(len(haikuDict[0]) - 1):
-                    entryDict[haikuDict[0][i]] = entry[i]
-                if tree.isItemInNode(entryDict, self):
-                    if entry[-1] == "yes" or entry[-1] == "no":
-                        i = haikuDict[0].index(self.name)
-                        if entry[i] != "yes" and entry[i] != "no" and entry[i] != "None":
-                            numAttribute = int(entry[i])
-                        else:
-                            numAttribute = 0
-                    if entry[-1] == "yes":
-                        totalPosRating += numAttribute
-                        totalPosRatingSquared += numAttribute**2
-                    self.totalOverallAttr += numAttribute
-        if self.totalOverallAttr == 0:
-            self.totalOverallAttr = 0.0000001
-        self.meanFrequencies = totalPosRatingSquared / self.totalOverallAttr
-        meanFrequenciesSquared = (totalPosRating / self.totalOverallAttr)**2
-        sigma = math.sqrt(abs(self.meanFrequencies - meanFrequenciesSquared))
-
-        #this is just a formula for 95% confidence interval.  1.96 was taking from a random
-        #stats table in my stats book :p
-        lowerBound = self.meanFrequencies - 1.96*sigma
-        upperBound = self.meanFrequencies + 1.96*sigma
+        #the tree is compiled once and all the rows sent down it together;
+        #createConfidenceHeap does every node in the same pass
+        #the numbers come from CompiledTree.confidenceStats, so they are the same
+        #ones createConfidenceHeap gives this node
+        table = DataTable(haikuDict)
+        compiledTree = tree.compile(table.names)
+        stats = compiledTree.confidenceStats(table.getFeatures(), table.labels)
+        meanFrequencies, totalOverallAttr, lowerBound, upperBound = [float(stat[compiledTree.getIndex(self)]) for stat in stats]
+        self.meanFrequencies = meanFrequencies
+        self.totalOverallAttr = totalOverallAttr
 
         #confidence interval is a tuple of upper and lower bound
         self.confidence_interval = (lowerBound, upperBound)
 
+    def setConfidenceInterval(self, lowerBound, upperBound):
+        self.confidence_interval = (lowerBound, upperBound)
+
     def getConfidence(self):
         return self.confidence_interval
 
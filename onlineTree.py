@@ -0,0 +1,170 @@
+'''
+Holly French and Alexandra Price
+
+This file contains the OnlineTree class, which keeps a decision tree
+up to date as new ratings come in, without regrowing it.
+'''
+import numpy as np
+from numericTreeClass import *
+from dataTable import DataTable
+import ID3
+
+class OnlineTree:
+    '''
+    Keeps the counts of every node of an ID3 tree (see ID3.makeCountTree).
+    When a row gets rated, its counts are added along its path, and each node
+    on the way redoes its decision from the new counts; a subtree is only
+    regrown where that decision changes (or a leaf stops being pure).
+    So the tree is always the one makeTree would grow from scratch,
+    but a rating only costs a few node decisions.
+
+    getTree gives that tree unpruned. The model ID3.main serves is pruned,
+    so it uses getPrunedTree, which prunes a fresh copy the same way getModel does.
+    '''
+    def __init__(self, dataSet):
+        if isinstance(dataSet, DataTable):
+            self.table = dataSet
+        else:
+            self.table = DataTable(dataSet)
+        self.attributes = frozenset(range(len(self.table.names)))
+        self.countTree = ID3.makeCountTree(self.table, self.table.allRows(), self.attributes)
+        self.tree = None #made from the counts when it is asked for
+
+    def getTable(self):
+        return self.table
+
+    def rate(self, row, rating):
+        '''
+        Gives row of the table the rating "yes" or "no" (anything else unrates it)
+        and updates the tree to match.
+        '''
+        table = self.table
+        label = {"yes": 1, "no": 0}.get(rating, -1)
+        oldLabel = table.labels[row]
+        if label == oldLabel:
+            return
+        table.labels[row] = label
+        yesChange = int(label == 1) - int(oldLabel == 1)
+        noChange = int(label == 0) - int(oldLabel == 0)
+        self.tree = None
+
+        levels = table.codes[:, row]
+        countNode = self.countTree
+        attributes = self.attributes
+        parent = None
+        childIndex = None
+        while True:
+            countNode["numYes"][levels] += yesChange
+            countNode["numNo"][levels] += noChange
+            decision = ID3.nodeDecision(table, countNode["numYes"], countNode["numNo"], attributes)
+            if decision != countNode["decision"]:
+                #the split changed, so everything below it has to be regrown
+                newNode = ID3.makeCountTree(table, countNode["rows"], attributes)
+                if parent is None:
+                    self.countTree = newNode
+                else:
+                    parent["children"][childIndex] = newNode
+                return
+            category, outcome, splitNum = decision
+            if outcome:
+                return
+
+            cut = ID3.getSplitCut(table, category, splitNum)
+            start = table.offsets[category]
+            end = table.offsets[category + 1]
+            if levels[category] < cut:
+                side = 0
+                childOutcome = ID3.childOutcome(countNode["numYes"][start:cut].sum(), countNode["numNo"][start:cut].sum())
+            else:
+                side = 1
+                childOutcome = ID3.childOutcome(countNode["numYes"][cut:end].sum(), countNode["numNo"][cut:end].sum())
+            remaining = attributes - frozenset([category])
+            if childOutcome:
+                countNode["children"][side] = None #the child is a leaf (maybe it just became one)
+                return
+            if countNode["children"][side] is None:
+                #a leaf that is not pure anymore gets grown
+                rows = countNode["rows"]
+                if side == 0:
+                    childRows = rows[table.codes[category, rows] < cut]
+                else:
+                    childRows = rows[table.codes[category, rows] >= cut]
+                countNode["children"][side] = ID3.makeCountTree(table, childRows, remaining)
+                return
+            parent = countNode
+            childIndex = side
+            countNode = countNode["children"][side]
+            attributes = remaining
+
+    def getTree(self):
+        '''
+        Returns the DecisionTree for the current counts, the same one
+        makeTree would make from the table with its current ratings.
+        '''
+        if self.tree is None:
+            self.tree = self.buildTree()
+        return self.tree
+
+    def getPrunedTree(self, significance=.05):
+        '''
+        Returns the tree for the current counts after ID3.chiSquarePruning,
+        the same one getModel would train from the table with its current ratings.
+        Pruning changes the tree, so a new one is built every time.
+        '''
+        tree = self.buildTree()
+        ID3.chiSquarePruning(tree, significance)
+        return tree
+
+    def buildTree(self):
+        tree = DecisionTree()
+        rootNode = Node()
+        tree.setRoot(rootNode)
+        self.makeNodes(rootNode, self.countTree, self.attributes)
+        tree.contract()
+        return tree
+
+    def makeNodes(self, rootNode, countNode, attributes):
+        '''
+        Fills in rootNode and its children from a count node,
+        the same way makeTreeHelper would.
+        '''
+        table = self.table
+        numYes = countNode["numYes"]
+        numNo = countNode["numNo"]
+        category, outcome, splitNum = countNode["decision"]
+        totalYes = int(numYes[table.offsets[0]:table.offsets[1]].sum())
+        totalNo = int(numNo[table.offsets[0]:table.offsets[1]].sum())
+        rootNode.setNumItems(totalYes + totalNo)
+        rootNode.setNumYes(totalYes)
+        rootNode.setNumNo(totalNo)
+        if category is None:
+            rootNode.setName("Outcome")
+        else:
+            rootNode.setName(table.names[category])
+        if outcome:
+            rootNode.setOutcome(outcome)
+            return
+
+        cut = ID3.getSplitCut(table, category, splitNum)
+        start = table.offsets[category]
+        end = table.offsets[category + 1]
+        remaining = attributes - frozenset([category])
+        for side, edgeLabel, first, last in [(0, "<= ", start, cut), (1, "> ", cut, end)]:
+            childNode = Node()
+            childNode.setParent(rootNode)
+            rootNode.addChild(childNode)
+            childNode.setValue(edgeLabel + str(splitNum))
+            childNode.setName("Outcome")
+            childYes = int(numYes[first:last].sum())
+            childNo = int(numNo[first:last].sum())
+            childNode.setNumItems(childYes + childNo)
+            childNode.setNumYes(childYes)
+            childNode.setNumNo(childNo)
+            childOutcome = ID3.childOutcome(childYes, childNo)
+            if childOutcome:
+                childNode.setOutcome(childOutcome)
+            else:
+                self.makeNodes(childNode, countNode["children"][side], remaining)
+
+    def search(self, itemDict):
+        return self.getTree().search(itemDict)
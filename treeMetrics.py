@@ -0,0 +1,122 @@
+'''
+Opt-in instrumentation for the decision tree code.
+
+While a TreeMetrics is recording, makeTree, makeTreeHelper (split search and
+partitioning the rows), findBestSplitNum, chiSquarePruning, looCV and
+crossValidate add their phase times and counts to it:
+
+    with recording() as metrics:
+        tree = ID3.makeTree(table)
+    print metrics.report()
+
+When nothing is recording, each of those functions only checks that active is None.
+Work done in other processes (the folds of crossValidate when it has more than
+one process, makeForest) is not recorded, only the total time.
+'''
+import time
+
+active = None #the TreeMetrics currently recording, if any
+
+class TreeMetrics:
+    '''
+    Phase timers (seconds), counters, and the deepest node built.
+    If a callback is given, it gets the asDict() of the metrics when recording stops,
+    which is the place to hand them to a metrics pipeline.
+    '''
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.timers = {}
+        self.counters = {}
+        self.maxDepth = 0
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def addTime(self, phase, seconds):
+        self.timers[phase] = self.timers.get(phase, 0.0) + seconds
+
+    def noteDepth(self, depth):
+        if depth > self.maxDepth:
+            self.maxDepth = depth
+
+    def asDict(self):
+        return {"timers": dict(self.timers), "counters": dict(self.counters), "maxDepth": self.maxDepth}
+
+    def report(self):
+        '''
+        Returns a readable summary of everything recorded.
+        '''
+        lines = []
+        for phase in sorted(self.timers):
+            lines.append("%-24s %10.4f s" % (phase, self.timers[phase]))
+        for name in sorted(self.counters):
+            lines.append("%-24s %10d" % (name, self.counters[name]))
+        lines.append("%-24s %10d" % ("maxDepth", self.maxDepth))
+        return "\n".join(lines)
+
+class PhaseTimer:
+    '''
+    Adds the time spent inside a with block to a phase of the active metrics.
+    '''
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.metrics.addTime(self.phase, time.time() - self.start)
+        return False
+
+class NoTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        return False
+
+noTimer = NoTimer()
+
+def timed(phase):
+    '''
+    Use as "with timed(phase):". Does nothing unless metrics are recording.
+    '''
+    if active is None:
+        return noTimer
+    return PhaseTimer(active, phase)
+
+def startRecording(callback=None):
+    '''
+    Starts recording into a new TreeMetrics and returns it.
+    '''
+    global active
+    active = TreeMetrics(callback)
+    return active
+
+def stopRecording():
+    '''
+    Stops recording, calls the callback if there is one, and returns the metrics.
+    '''
+    global active
+    metrics = active
+    active = None
+    if metrics is not None and metrics.callback is not None:
+        metrics.callback(metrics.asDict())
+    return metrics
+
+class recording:
+    '''
+    Records everything in a with block:
+    with recording(callback) as metrics: ...
+    '''
+    def __init__(self, callback=None):
+        self.callback = callback
+
+    def __enter__(self):
+        return startRecording(self.callback)
+
+    def __exit__(self, excType, excValue, traceback):
+        stopRecording()
+        return False
@@ -0,0 +1,150 @@
+'''
+Searches for the settings that make the best trees: how deep makeTree may grow
+(maxDepth), how many rated rows each side of a split needs (minLeaf), and the
+significance level chiSquarePruning prunes at. Every setting is scored with
+k-fold cross validation.
+
+Run it as:  python tuneTree.py haikuTable.txt [--folds 10] [--random 20] [--top 10]
+'''
+import sys, itertools, argparse
+import numpy as np
+import ID3
+from dataTable import DataTable
+from workerPool import runTasks
+
+MAX_DEPTHS = [None, 2, 3, 4, 6]
+MIN_LEAVES = [None, 5, 20, 50]
+SIGNIFICANCES = [None, .2, .05, .01, .001] #None means no pruning
+
+def makeGrid(maxDepths=MAX_DEPTHS, minLeaves=MIN_LEAVES, significances=SIGNIFICANCES):
+    '''
+    Returns every combination of the settings as a list of dictionaries
+    {"maxDepth": ..., "minLeaf": ..., "significance": ...}.
+    '''
+    return [{"maxDepth": maxDepth, "minLeaf": minLeaf, "significance": significance}
+            for maxDepth, minLeaf, significance in itertools.product(maxDepths, minLeaves, significances)]
+
+def sampleGrid(grid, numSettings, seed=0):
+    '''
+    Picks numSettings of the settings in grid at random, for a random search.
+    '''
+    if numSettings >= len(grid):
+        return list(grid)
+    picked = np.random.RandomState(seed).choice(len(grid), numSettings, replace=False)
+    return [grid[i] for i in sorted(picked)]
+
+def pruningOrder(significance):
+    '''
+    Sorts significance levels from the one that prunes least (None, no pruning)
+    to the one that prunes most.
+    '''
+    if significance is None:
+        return -1.0
+    return -significance
+
+tuneTable = None #the DataTable a searchSettings worker process trains on
+
+def initTuneWorker(table):
+    global tuneTable
+    tuneTable = table
+
+def testSettings(args):
+    '''
+    Trains one tree on every row but testRows with the given maxDepth and minLeaf,
+    then scores it at each of the significance levels. Pruning at a smaller
+    significance only prunes more, so the tree is pruned a bit further for each
+    level instead of being grown again (this gives the same trees).
+    Runs in a worker process, on the table given to initTuneWorker.
+    Returns a list of (numCorrect, numItems), one per significance in the order given.
+    '''
+    testRows, maxDepth, minLeaf, significances = args
+    table = tuneTable
+    allRows = table.allRows()
+    trainRows = allRows[~np.in1d(allRows, testRows)]
+    tree = ID3.makeTree(table, trainRows, None, maxDepth, minLeaf)
+    scores = {}
+    for significance in sorted(set(significances), key=pruningOrder):
+        if significance is not None:
+            ID3.chiSquarePruning(tree, significance)
+        scores[significance] = ID3.scoreTree(table, tree, testRows)
+    return [scores[significance] for significance in significances]
+
+def searchSettings(dataSet, settings=None, numFolds=10, seed=0, numProcesses=None):
+    '''
+    Scores every setting (dictionaries like the ones makeGrid makes; the whole
+    default grid if settings is None) with numFolds-fold cross validation.
+    All the settings use the same folds (see ID3.assignFolds).
+
+    Settings that only differ in significance share their trees, so the work is
+    one task per fold and per (maxDepth, minLeaf). The tasks are spread over a
+    pool of worker processes that all read one shared copy of the table, whose
+    columns are already sorted level codes, so nothing gets sorted again.
+    numProcesses is passed on to workerPool.runTasks.
+
+    Returns the settings with their "accuracy" filled in, best first.
+    Equally accurate settings keep the order they were given in.
+    '''
+    if isinstance(dataSet, DataTable):
+        table = dataSet
+    else:
+        table = DataTable(dataSet)
+    if settings is None:
+        settings = makeGrid()
+    #settings that grow the same tree go in one group
+    groups = {}
+    for i, setting in enumerate(settings):
+        key = (setting["maxDepth"], setting["minLeaf"])
+        groups.setdefault(key, []).append(i)
+    folds = ID3.assignFolds(table, numFolds, seed)
+    tasks = []
+    taskGroups = []
+    for key in sorted(groups, key=lambda key: groups[key][0]):
+        significances = [settings[i]["significance"] for i in groups[key]]
+        for fold in folds:
+            tasks.append((fold, key[0], key[1], significances))
+            taskGroups.append(groups[key])
+    results = runTasks(testSettings, tasks, initTuneWorker, (table,), numProcesses)
+
+    numCorrect = np.zeros(len(settings))
+    numItems = np.zeros(len(settings))
+    for group, scores in zip(taskGroups, results):
+        for i, (correct, items) in zip(group, scores):
+            numCorrect[i] += correct
+            numItems[i] += items
+    ranked = []
+    for i, setting in enumerate(settings):
+        setting = dict(setting)
+        setting["accuracy"] = numCorrect[i] / max(numItems[i], 1)
+        ranked.append(setting)
+    ranked.sort(key=lambda setting: -setting["accuracy"]) #sort is stable, so ties keep their order
+    return ranked
+
+def makeReport(ranked, top=None):
+    '''
+    Returns the ranked settings from searchSettings as a table, one line each.
+    '''
+    lines = ["%-5s %-9s %-8s %-13s %s" % ("rank", "maxDepth", "minLeaf", "significance", "accuracy")]
+    for rank, setting in enumerate(ranked[:top]):
+        lines.append("%-5d %-9s %-8s %-13s %.4f" % (rank + 1, setting["maxDepth"], setting["minLeaf"],
+                                                   setting["significance"], setting["accuracy"]))
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Searches for the best tree settings with k-fold cross validation.")
+    parser.add_argument("fileName", help="a table made by makeHaikuTable (text or binary)")
+    parser.add_argument("--folds", type=int, default=10, help="number of cross validation folds")
+    parser.add_argument("--random", type=int, help="only try this many settings, picked at random")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the folds and the random settings")
+    parser.add_argument("--processes", type=int, help="number of worker processes (default: all cores)")
+    parser.add_argument("--top", type=int, help="only show this many settings")
+    args = parser.parse_args()
+
+    table = ID3.readTable(args.fileName)
+    settings = makeGrid()
+    if args.random:
+        settings = sampleGrid(settings, args.random, args.seed)
+    ranked = searchSettings(table, settings, args.folds, args.seed, args.processes)
+    print makeReport(ranked, args.top)
+
+if __name__=="__main__":
+    main()
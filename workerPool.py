@@ -0,0 +1,60 @@
+'''
+Runs a function over many tasks in a pool of worker processes, for the code
+that spreads its work over the cores (cross validation, tuneTree, makeForest
+and buildTableFile).
+
+Each worker is set up once by an initializer (which keeps what it is given in
+a global of its module), so the tasks themselves only need to carry a little:
+
+    for result in runTasks(testFold, tasks, initCVWorker, (table,)):
+        ...
+'''
+import collections, multiprocessing
+
+def runTasks(function, tasks, initializer, initargs=(), numProcesses=None, chunkSize=1, maxWaiting=None):
+    '''
+    Yields function(task) for every task, in the order of tasks.
+    The work is done by a pool of numProcesses worker processes, each set up
+    with initializer(*initargs) when it starts; numProcesses defaults to the
+    number of cores, and 1 runs everything in this process (no pool at all).
+    Any of initargs with a share method (a DataTable) is put in shared memory
+    first, so the workers all read one copy instead of each getting their own.
+
+    The tasks go out chunkSize at a time. If maxWaiting is given, tasks is only
+    read as the results come back (see orderedResults), so it can be a generator
+    too big to hold in memory at once.
+    '''
+    if numProcesses is None:
+        numProcesses = multiprocessing.cpu_count()
+    if numProcesses == 1:
+        initializer(*initargs)
+        for task in tasks:
+            yield function(task)
+        return
+
+    initargs = tuple(arg.share() if hasattr(arg, "share") else arg for arg in initargs)
+    pool = multiprocessing.Pool(numProcesses, initializer, initargs)
+    try:
+        if maxWaiting is None:
+            results = pool.imap(function, tasks, chunkSize)
+        else:
+            results = orderedResults(pool, function, tasks, maxWaiting)
+        for result in results:
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+def orderedResults(pool, function, tasks, maxWaiting):
+    '''
+    Like pool.imap(function, tasks), but only takes the next task once fewer
+    than maxWaiting are waiting, instead of reading all of tasks up front.
+    Yields the results in the order of tasks.
+    '''
+    waiting = collections.deque()
+    for task in tasks:
+        if len(waiting) >= maxWaiting:
+            yield waiting.popleft().get()
+        waiting.append(pool.apply_async(function, (task,)))
+    while waiting:
+        yield waiting.popleft().get()